@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""端到端检测延迟分析：文章发布 → 监控第一次看到 → 提醒邮件发出
+
+按时间顺序流式读取 logs/*.log（含压缩的 .log.gz）和结构化事件日志
+logs/events/*.jsonl（如果存在），每个文件只读一遍；只在内存中保留最近
+--window-hours 小时内出现的文章，延迟分布用对数分桶统计，因此内存占用与日志总量无关。
+
+用法: python analyze_latency.py [--log-dir logs] [--since 2025-03-01] [--until 2025-03-31]
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from article_store import canonical_article_key
+from log_writer import list_log_files, open_log_file
+
+
+LINE_PATTERN = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] (.*)$")
+ACCOUNT_PATTERN = re.compile(r"^Found \d+ article for (.+)$")
+URL_PATTERN = re.compile(r"^Article URL: (\S+)$")
+PUBLISH_PATTERN = re.compile(r"^Publish time: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})$")
+CHECKING_PATTERN = re.compile(r"^Checking new article: (.*) - (\S+)$")
+TOO_OLD_PATTERN = re.compile(r"^Skipping article older than [\d.]+ hours: (.*)$")
+ALERT_PATTERN = re.compile(r"^Email alert sent to .+ for article: (.*)$")
+# 逐个收件人的发送行只带收件人和发件账号，欢迎邮件也使用同样的格式
+ALERT_USING_PATTERN = re.compile(r"^Email alert sent to \S+ using \S+$")
+
+
+def parse_time(value):
+    return time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+
+
+def text_log_records(log_dir):
+    """把文本日志解析为 (时间, 类型, 字段) 记录
+
+    文章发布时间只出现在抓取时的 "Article URL:"/"Publish time:" 行中，"Checking new article"
+    是第一次检查文章的时刻；"... for article: <标题>" 形式的提醒发送行只带文章标题，由分析器按标题对应到文章。
+    "Email alert sent to X using Y" 形式的发送行不带文章，归到同一文件中最近一次 "Found keywords in article"
+    所在的文章（每次命中只取第一行）；欢迎邮件的发送行被忽略，其余无法归属的发送行单独计数。
+    """
+    for path in list_log_files(log_dir):
+        account = None
+        url = None
+        checking = None  # 最近一次检查的文章 (文章键, 标题)
+        sending = None  # 正在发送的邮件：命中关键词的文章 (文章键, 标题)、"welcome" 或 None
+        reported = False  # 本次命中的提醒是否已记录
+        try:
+            f = open_log_file(path)
+        except FileNotFoundError:
+            # 列出之后被删除
+            continue
+        with f:
+            for line in f:
+                match = LINE_PATTERN.match(line.rstrip("\n"))
+                if not match:
+                    continue
+                message = match.group(2)
+                try:
+                    ts = parse_time(match.group(1))
+                except ValueError:
+                    continue
+                if message.startswith("Found keywords in article"):
+                    sending, reported = checking, False
+                elif message.startswith("Found "):
+                    found = ACCOUNT_PATTERN.match(message)
+                    if found:
+                        account = found.group(1)
+                elif message.startswith("Article URL: "):
+                    found = URL_PATTERN.match(message)
+                    url = found.group(1) if found else None
+                elif message.startswith("Publish time: "):
+                    found = PUBLISH_PATTERN.match(message)
+                    if found and url:
+                        try:
+                            publish_time = parse_time(found.group(1))
+                        except ValueError:
+                            continue
+                        yield ts, "published", {
+                            "article_key": canonical_article_key(url), "account": account, "publish_time": publish_time
+                        }
+                    url = None
+                elif message.startswith("Checking new article: "):
+                    found = CHECKING_PATTERN.match(message)
+                    if found:
+                        checking = (canonical_article_key(found.group(2)), found.group(1))
+                        sending = None
+                        yield ts, "seen", {"article_key": checking[0], "title": checking[1]}
+                elif message.startswith("Sending welcome emails"):
+                    sending = "welcome"
+                elif message.startswith(("Welcome email sending completed", "Email sending completed",
+                                         "Starting monitoring process", "WeChatMonitor initialized")):
+                    sending = None
+                elif message.startswith("Skipping article older than "):
+                    found = TOO_OLD_PATTERN.match(message)
+                    if found:
+                        yield ts, "too_old", {"title": found.group(1)}
+                elif message.startswith("Email alert sent to "):
+                    found = ALERT_PATTERN.match(message)
+                    if found:
+                        yield ts, "alert", {"title": found.group(1)}
+                    elif ALERT_USING_PATTERN.match(message):
+                        if sending == "welcome":
+                            continue
+                        if sending is None:
+                            yield ts, "unattributed_alert", {}
+                        elif not reported:
+                            reported = True
+                            yield ts, "alert", {"article_key": sending[0], "title": sending[1]}
+
+
+def event_log_records(events_dir):
+    """把结构化事件日志中的 article_seen 和提醒的 email_sent 事件转换为记录"""
+    for path in list_log_files(events_dir, '.jsonl'):
+        try:
+            f = open_log_file(path)
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    ts = float(record['ts'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                event = record.get('event')
+                if event == 'article_seen':
+                    fields = {
+                        "article_key": record.get('article_key'), "account": record.get('account'),
+                        "title": record.get('title'), "publish_time": record.get('publish_time')
+                    }
+                    yield ts, "seen", fields
+                    if record.get('skipped') == "too old":
+                        yield ts, "too_old", {"article_key": record.get('article_key')}
+                elif event == 'email_sent' and record.get('kind') == 'alert':
+                    yield ts, "alert", {"article_key": record.get('article_key')}
+
+
+class LatencyDigest:
+    """对数分桶的延迟分布，分位数的相对误差不超过 (GAMMA - 1) / 2"""
+
+    GAMMA = 1.02
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, seconds):
+        index = math.ceil(math.log(max(seconds, 1.0), self.GAMMA))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # 返回桶的中点，桶 i 覆盖 (GAMMA^(i-1), GAMMA^i]
+                return 2 * self.GAMMA ** index / (self.GAMMA + 1) if index > 0 else 0.0
+        return None
+
+
+class LatencyAnalyzer:
+    """把按时间排序的记录按文章关联起来，统计检测延迟和提醒延迟
+
+    每篇文章在第一次出现后保留 window 秒，期间文本日志和事件日志对同一篇文章的记录合并为一条；
+    超出窗口的文章计入统计后从内存中移除。
+    """
+
+    def __init__(self, window, since=None, until=None):
+        self.window = window
+        self.since = since
+        self.until = until
+        self.articles = OrderedDict()  # 文章键 -> 状态，按第一次出现的时间排序
+        self.titles = {}  # 标题 -> 文章键，用于关联只带标题的提醒发送日志
+        self.stats = {}  # (分组, 名称) -> {"detect": LatencyDigest, "alert": LatencyDigest}
+        self.too_old = 0
+        self.unmatched_alerts = 0
+        self.unattributed_alerts = 0  # 无法归到任何文章的逐收件人发送行
+
+    def feed(self, ts, kind, fields):
+        self.expire(ts)
+        if kind == "unattributed_alert":
+            self.unattributed_alerts += 1
+            return
+        key = fields.get('article_key')
+        if key is None and fields.get('title') is not None:
+            key = self.titles.get(fields['title'])
+        if key is None:
+            if kind == "alert":
+                self.unmatched_alerts += 1
+            return
+        article = self.articles.get(key)
+        if article is None:
+            if kind == "alert":
+                self.unmatched_alerts += 1
+                return
+            article = self.articles[key] = {
+                "first": ts, "account": None, "publish_time": None, "seen": None, "alert": None, "too_old": False
+            }
+        if fields.get('account') and not article['account']:
+            article['account'] = fields['account']
+        if fields.get('publish_time') and not article['publish_time']:
+            article['publish_time'] = float(fields['publish_time'])
+        if kind == "seen":
+            if article['seen'] is None or ts < article['seen']:
+                article['seen'] = ts
+            if fields.get('title'):
+                self.titles[fields['title']] = key
+                article['title'] = fields['title']
+        elif kind == "too_old":
+            article['too_old'] = True
+        elif kind == "alert":
+            if article['seen'] is None:
+                self.unmatched_alerts += 1
+            elif article['alert'] is None or ts < article['alert']:
+                article['alert'] = ts
+
+    def expire(self, now=None):
+        """统计并移除超出窗口的文章，now 为 None 时处理全部"""
+        while self.articles:
+            key, article = next(iter(self.articles.items()))
+            if now is not None and now - article['first'] <= self.window:
+                return
+            del self.articles[key]
+            if article.get('title') and self.titles.get(article['title']) == key:
+                del self.titles[article['title']]
+            self.finish(article)
+
+    def finish(self, article):
+        if article['seen'] is None or article['publish_time'] is None:
+            return
+        if article['too_old']:
+            self.too_old += 1
+            return
+        day = time.strftime("%Y-%m-%d", time.localtime(article['publish_time']))
+        if (self.since and day < self.since) or (self.until and day > self.until):
+            return
+        groups = [("total", "all"), ("account", article['account'] or "?"), ("day", day)]
+        for group in groups:
+            digests = self.stats.get(group)
+            if digests is None:
+                digests = self.stats[group] = {"detect": LatencyDigest(), "alert": LatencyDigest()}
+            digests['detect'].add(article['seen'] - article['publish_time'])
+            if article['alert'] is not None:
+                digests['alert'].add(article['alert'] - article['publish_time'])
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 60:
+        return f"{value:.0f}s"
+    if value < 3600:
+        return f"{value / 60:.1f}m"
+    return f"{value / 3600:.1f}h"
+
+
+def pad(text, width):
+    """按显示宽度左对齐（中文字符占两列）"""
+    text_width = 0
+    for i, char in enumerate(text):
+        char_width = 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+        if text_width + char_width > width:
+            return text[:i] + " " * (width - text_width)
+        text_width += char_width
+    return text + " " * (width - text_width)
+
+
+def print_report(analyzer):
+    header = (f"{'':<28} {'seen':>6} {'p50':>7} {'p95':>7} {'p99':>7}"
+              f" {'alerts':>7} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for group, title in [("total", "Overall"), ("account", "Per account"), ("day", "Per day (publish date)")]:
+        rows = sorted((name, digests) for (kind, name), digests in analyzer.stats.items() if kind == group)
+        if not rows:
+            continue
+        print(f"\n{title}  (seen = publish -> first seen, alerts = publish -> alert sent)")
+        print(header)
+        for name, digests in rows:
+            detect, alert = digests['detect'], digests['alert']
+            print(f"{pad(name, 28)} {detect.count:>6}"
+                  + "".join(f" {format_seconds(detect.quantile(q)):>7}" for q in (0.5, 0.95, 0.99))
+                  + f" {alert.count:>7}"
+                  + "".join(f" {format_seconds(alert.quantile(q)):>7}" for q in (0.5, 0.95, 0.99)))
+    print(f"\nSkipped as too old: {analyzer.too_old}, alerts without a matching article: {analyzer.unmatched_alerts}, "
+          f"alert send lines not attributed to an article: {analyzer.unattributed_alerts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection latency report from monitor logs")
+    parser.add_argument("--log-dir", default="logs", help="日志目录")
+    parser.add_argument("--events-dir", default=None, help="结构化事件日志目录（默认 <log-dir>/events）")
+    parser.add_argument("--since", default=None, help="只统计该日期（YYYY-MM-DD）及之后发布的文章")
+    parser.add_argument("--until", default=None, help="只统计该日期（YYYY-MM-DD）及之前发布的文章")
+    parser.add_argument("--window-hours", type=float, default=48,
+                        help="文章第一次出现后等待提醒发送的最长时间（小时）")
+    args = parser.parse_args()
+
+    events_dir = args.events_dir or os.path.join(args.log_dir, "events")
+    analyzer = LatencyAnalyzer(args.window_hours * 3600, since=args.since, until=args.until)
+    # 两个来源各自按时间排序，合并成一个有序的流
+    records = heapq.merge(text_log_records(args.log_dir), event_log_records(events_dir), key=lambda record: record[0])
+    for ts, kind, fields in records:
+        analyzer.feed(ts, kind, fields)
+    analyzer.expire()
+    print_report(analyzer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import base64
+import binascii
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+def canonical_article_key(url):
+    """从文章链接解析出紧凑的规范键 "<biz>:<mid>:<idx>"
+
+    同一篇文章的链接可能带有不同的 chksm/sn 等参数，但 (__biz, mid, idx) 唯一确定一篇文章。
+    __biz 是公众号 uin 的 base64 编码，解码成十进制数字以进一步缩短。
+    无法解析的链接（如短链接）原样返回。
+    """
+    try:
+        query = parse_qs(urlsplit(url).query)
+        biz = query['__biz'][0]
+        mid = int(query['mid'][0])
+        idx = int(query['idx'][0])
+    except (KeyError, IndexError, ValueError):
+        return url
+    try:
+        decoded = base64.b64decode(biz).decode('ascii')
+        if decoded.isdigit():
+            biz = decoded
+    except (binascii.Error, UnicodeDecodeError):
+        pass
+    return f"{biz}:{mid}:{idx}"
+
+
+class BloomFilter:
+    """内存中的布隆过滤器
+
+    "一定没见过"的判断无需查询数据库；每个元素约占 -ln(p)/ln(2)^2 位
+    （误判率1%时约1.2字节）。
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        """用双重哈希生成 num_hashes 个位置"""
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SeenArticleStore:
+    """基于SQLite（WAL模式）的已检查文章存储
+
+    每篇文章一行，以规范文章键（见 canonical_article_key）为主键逐条 upsert，
+    保存开销只与新文章数量有关，启动时也无需把全部历史读入内存。首次打开时会把旧的
+    checked_articles.json 一次性导入。数据库前面有一个布隆过滤器，
+    对新文章的查询大多不必访问数据库。
+    """
+
+    # 布隆过滤器的最小容量，实际容量为已有文章数的两倍与该值中的较大者
+    MIN_BLOOM_CAPACITY = 10000
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS seen_articles (
+                article_key TEXT PRIMARY KEY,
+                account TEXT,
+                title TEXT,
+                check_time TEXT,
+                skipped TEXT,
+                publish_time INTEGER
+            )"""
+        )
+        # 旧版本的表没有 publish_time 列
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(seen_articles)")]
+        if 'publish_time' not in columns:
+            self.conn.execute("ALTER TABLE seen_articles ADD COLUMN publish_time INTEGER")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_articles_publish_time ON seen_articles (publish_time)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        if legacy_json_path:
+            self.migrate_from_json(legacy_json_path)
+        self.migrate_to_canonical_keys()
+        self.rebuild_bloom()
+
+    def migrate_from_json(self, json_path):
+        """从旧的 checked_articles.json 一次性导入，导入后在 meta 表中记录，不再重复导入
+
+        Returns:
+            int: 导入的文章数
+        """
+        with self.lock:
+            migrated = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_json'"
+            ).fetchone()
+        if migrated or not os.path.exists(json_path):
+            return 0
+
+        with open(json_path, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+        rows = [
+            (canonical_article_key(key), None, info.get('title'), info.get('check_time'), info.get('skipped'))
+            for key, info in legacy.items()
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_articles (article_key, account, title, check_time, skipped) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)",
+                (json_path,)
+            )
+        print(f"Migrated {len(rows)} checked articles from {json_path} to {self.db_path}")
+        return len(rows)
+
+    def migrate_to_canonical_keys(self):
+        """把以完整链接为键的旧记录改写为规范键，同一文章的多条记录合并为一条"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT article_key, account, title, check_time, skipped FROM seen_articles "
+                "WHERE article_key LIKE 'http%'"
+            ).fetchall()
+        rows = [row for row in rows if canonical_article_key(row[0]) != row[0]]
+        if not rows:
+            return 0
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_articles (article_key, account, title, check_time, skipped) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(canonical_article_key(row[0]),) + tuple(row[1:]) for row in rows]
+            )
+            self.conn.executemany(
+                "DELETE FROM seen_articles WHERE article_key = ?",
+                [(row[0],) for row in rows]
+            )
+        print(f"Rewrote {len(rows)} checked articles to canonical keys")
+        return len(rows)
+
+    def rebuild_bloom(self):
+        """从数据库重建布隆过滤器（逐行读取，不把全部键放进内存）"""
+        capacity = max(self.MIN_BLOOM_CAPACITY, 2 * len(self))
+        bloom = BloomFilter(capacity)
+        with self.lock:
+            for (article_key,) in self.conn.execute("SELECT article_key FROM seen_articles"):
+                bloom.add(article_key)
+            self.bloom = bloom
+
+    def __contains__(self, article_key):
+        # 布隆过滤器判定不存在时一定不存在，无需查询数据库
+        if article_key not in self.bloom:
+            return False
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM seen_articles WHERE article_key = ?", (article_key,)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen_articles").fetchone()[0]
+
+    def get(self, article_key):
+        """获取文章记录，不存在时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT account, title, check_time, skipped, publish_time FROM seen_articles WHERE article_key = ?",
+                (article_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"account": row[0], "title": row[1], "check_time": row[2], "skipped": row[3], "publish_time": row[4]}
+
+    def mark(self, article_key, title, check_time, account=None, skipped=None, publish_time=None):
+        """记录（或更新）一篇已检查的文章
+
+        Args:
+            publish_time: 文章发布时间戳（秒），用于按保留期限淘汰
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO seen_articles (article_key, account, title, check_time, skipped, publish_time) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(article_key) DO UPDATE SET "
+                "account = excluded.account, title = excluded.title, "
+                "check_time = excluded.check_time, skipped = excluded.skipped, "
+                "publish_time = excluded.publish_time",
+                (article_key, account, title, check_time, skipped, publish_time)
+            )
+            self.bloom.add(article_key)
+        # 超出容量后误判率上升，按新的规模重建
+        if self.bloom.count > self.bloom.capacity:
+            self.rebuild_bloom()
+
+    def evict_older_than(self, cutoff):
+        """删除发布时间早于 cutoff（时间戳）的记录并压缩数据库
+
+        没有发布时间的旧记录按检查时间判断——检查时间总是晚于发布时间，
+        因此不会误删仍可能被再次抓到的文章。删除后重建布隆过滤器。
+
+        Returns:
+            int: 删除的记录数
+        """
+        cutoff_check_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cutoff))
+        with self.lock, self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM seen_articles WHERE publish_time < ? "
+                "OR (publish_time IS NULL AND check_time < ?)",
+                (int(cutoff), cutoff_check_time)
+            ).rowcount
+        if deleted:
+            with self.lock:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.rebuild_bloom()
+        return deleted
+
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""关键词匹配微基准：逐个关键词 `in` 查找 vs Aho-Corasick 单次扫描
+
+用法: python bench_keywords.py [--repeat N]
+"""
+import argparse
+import json
+import random
+import timeit
+
+from keyword_matcher import KeywordMatcher
+
+
+def naive_check_keywords(keywords, text):
+    """原 check_keywords 的实现：每个关键词单独查找一次"""
+    if not text:
+        return []
+    found_keywords = []
+    for keyword in keywords:
+        if keyword in text:
+            found_keywords.append(keyword)
+    return found_keywords
+
+
+def load_base_keywords(config_path="config.json"):
+    """读取配置中的关键词，读取失败时使用内置示例"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['keywords']
+    except Exception:
+        return ["形势与政策", "形势政策", "志愿时数", "志愿时长"]
+
+
+def make_keywords(base_keywords, total, rng):
+    """在配置关键词基础上补充随机的中文关键词，凑满 total 个"""
+    keywords = list(base_keywords)
+    while len(keywords) < total:
+        length = rng.randint(2, 6)
+        keywords.append(''.join(chr(rng.randint(0x4e00, 0x9fa5)) for _ in range(length)))
+    return keywords[:total]
+
+
+def make_article(keywords, length, rng):
+    """生成一篇约 length 个字符的文章，其中随机嵌入少量关键词"""
+    chars = [chr(rng.randint(0x4e00, 0x9fa5)) for _ in range(length)]
+    for keyword in rng.sample(keywords, min(3, len(keywords))):
+        position = rng.randint(0, max(0, length - len(keyword)))
+        chars[position:position + len(keyword)] = keyword
+    return ''.join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyword matcher micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="每组测量的执行次数")
+    parser.add_argument("--length", type=int, default=20000, help="文章长度（字符）")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    base_keywords = load_base_keywords()
+
+    print(f"Article length: {args.length} characters, repeat: {args.repeat}")
+    print(f"{'keywords':>10} {'naive (ms)':>12} {'automaton (ms)':>15} {'build (ms)':>11} {'speedup':>8}")
+    for total in [len(base_keywords), 50, 200, 500, 1000]:
+        keywords = make_keywords(base_keywords, total, rng)
+        text = make_article(keywords, args.length, rng)
+
+        build_seconds = timeit.timeit(lambda: KeywordMatcher(keywords), number=1)
+        matcher = KeywordMatcher(keywords)
+        assert set(matcher.find_all(text)) == set(naive_check_keywords(keywords, text))
+
+        naive = timeit.timeit(lambda: naive_check_keywords(keywords, text), number=args.repeat) / args.repeat
+        # 直接测量自动机扫描，不走 find() 中少量关键词时的子串查找捷径
+        automaton = timeit.timeit(lambda: matcher.find_all(text), number=args.repeat) / args.repeat
+        print(f"{total:>10} {naive * 1000:>12.3f} {automaton * 1000:>15.3f} "
+              f"{build_seconds * 1000:>11.2f} {naive / automaton:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""启动基准：在全新的解释器中导入监控程序，记录冷启动耗时、内存占用和最慢的导入
+
+每次测量都启动一个新进程，模拟守护进程重启和运行测试脚本时的冷启动；
+另用 `python -X importtime` 运行一次，列出累计耗时最多的顶层导入。
+结果追加到 data/startup_benchmark.jsonl，并与上一次记录比较。
+
+用法: python bench_startup.py [--repeat N] [--module wechat_monitor] [--max-import-ms MS]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 在子进程中执行：测量导入耗时和导入后的峰值内存
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+import_ms = (time.perf_counter() - started) * 1000
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是KB，macOS 上是字节
+    rss_mb = rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+except ImportError:
+    rss_mb = None
+print(json.dumps({{"import_ms": import_ms, "rss_mb": rss_mb, "modules": len(sys.modules)}}))
+"""
+
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def measure(module):
+    """启动一个新解释器导入模块，返回 (进程总耗时ms, 子进程报告的结果)"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    return wall_ms, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_importtime(code):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    return result.stderr.splitlines()
+
+
+def import_profile(module):
+    """用 -X importtime 导入模块，返回按累计耗时排序的顶层导入 [(模块, 累计ms)]
+
+    解释器启动时（site 等）导入的模块不计入。
+    """
+    startup = set()
+    for line in run_importtime("pass"):
+        match = IMPORTTIME_PATTERN.match(line)
+        if match:
+            startup.add(match.group(4))
+    profile = {}
+    for line in run_importtime(f"import {module}"):
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        if name in startup:
+            continue
+        depth = len(match.group(3)) // 2
+        # 顶层导入，以及被测模块直接导入的模块
+        if depth == 0 or (depth == 1 and name.split('.')[0] != module):
+            profile[name] = max(profile.get(name, 0), int(match.group(2)) / 1000)
+    profile.pop(module, None)
+    return sorted(profile.items(), key=lambda item: item[1], reverse=True)
+
+
+def load_previous(record_path, module):
+    """读取同一模块的上一次记录"""
+    previous = None
+    try:
+        with open(record_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('module') == module:
+                    previous = record
+    except OSError:
+        pass
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark")
+    parser.add_argument("--module", default="wechat_monitor", help="要导入的模块")
+    parser.add_argument("--repeat", type=int, default=5, help="测量次数（取中位数）")
+    parser.add_argument("--top", type=int, default=10, help="列出的最慢导入数")
+    parser.add_argument("--record", default=os.path.join(BASE_DIR, "data", "startup_benchmark.jsonl"),
+                        help="追加记录的文件")
+    parser.add_argument("--no-record", action="store_true", help="不写入记录")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="导入耗时中位数超过该值时以非零状态退出，可用于发现性能回退")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(max(1, args.repeat))]
+    wall_ms = statistics.median(wall for wall, _ in runs)
+    import_ms = statistics.median(probe['import_ms'] for _, probe in runs)
+    rss_values = [probe['rss_mb'] for _, probe in runs if probe['rss_mb'] is not None]
+    rss_mb = statistics.median(rss_values) if rss_values else None
+    modules = runs[-1][1]['modules']
+    profile = import_profile(args.module)
+
+    print(f"Python {sys.version.split()[0]}, module {args.module}, {len(runs)} run(s)")
+    print(f"{'process (ms)':>14} {'import (ms)':>12} {'peak RSS (MB)':>14} {'modules':>8}")
+    rss_text = f"{rss_mb:.1f}" if rss_mb is not None else "-"
+    print(f"{wall_ms:>14.1f} {import_ms:>12.1f} {rss_text:>14} {modules:>8}")
+
+    print("\nSlowest imports (cumulative, -X importtime):")
+    for name, ms in profile[:args.top]:
+        print(f"{ms:>10.1f} ms  {name}")
+
+    previous = load_previous(args.record, args.module)
+    if previous:
+        print(f"\nPrevious record ({previous['date']}): process {previous['process_ms']:.1f} ms, "
+              f"import {previous['import_ms']:.1f} ms ({import_ms - previous['import_ms']:+.1f}), "
+              f"RSS {previous['rss_mb'] if previous['rss_mb'] is not None else '-'} MB")
+
+    if not args.no_record:
+        record = {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "module": args.module,
+            "process_ms": round(wall_ms, 1),
+            "import_ms": round(import_ms, 1),
+            "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+            "modules": modules,
+            "slowest": [[name, round(ms, 1)] for name, ms in profile[:args.top]]
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.record)), exist_ok=True)
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"\nImport time {import_ms:.1f} ms exceeds the limit of {args.max_import_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
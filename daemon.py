@@ -1,48 +1,206 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
+"""监控程序的守护进程
+
+运行 wechat_monitor.py 并逐行读取它的输出，写入按日期和大小切分的 logs/console/<日期>.log，
+不在内存中累积；通过子进程定期写入的心跳文件检查它是否存活、是否已就绪，
+卡住或退出时按指数退避重启，并把上一个进程最后的心跳交给新进程以恢复调度状态。
+"""
+import json
+import logging
+import logging.handlers
+import os
+import signal
 import subprocess
-import time
 import sys
-import logging
-from datetime import datetime
+import threading
+import time
+
+from log_writer import AsyncLogWriter
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('daemon.log'),
+        logging.handlers.RotatingFileHandler(
+            os.path.join(BASE_DIR, 'daemon.log'), maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8'
+        ),
         logging.StreamHandler(sys.stdout)
     ]
 )
 
-def run_monitor():
-    """运行监控程序，并在崩溃时自动重启"""
-    while True:
+
+class Supervisor:
+    """启动、监控并在需要时重启监控程序"""
+
+    # 一行输出的最大长度，超过时按该长度拆成多行
+    MAX_LINE_CHARS = 64 * 1024
+
+    def __init__(self, config):
+        """
+        Args:
+            config: config.json 中的 supervisor 配置
+        """
+        self.script = os.path.join(BASE_DIR, 'wechat_monitor.py')
+        self.heartbeat_path = os.path.join(BASE_DIR, 'data', 'heartbeat.json')
+        # 子进程停止写心跳超过该秒数视为卡住
+        self.liveness_timeout = config.get('liveness_timeout_seconds', 120)
+        # 启动后超过该秒数仍未就绪（完成第一轮抓取）视为启动失败
+        self.startup_timeout = config.get('startup_timeout_seconds', 900)
+        # 重启等待从 backoff_base 秒开始，连续失败时翻倍，不超过 backoff_max 秒
+        self.backoff_base = config.get('backoff_base_seconds', 5)
+        self.backoff_max = config.get('backoff_max_seconds', 600)
+        # 运行超过该秒数后退出不算连续失败，重启等待恢复为 backoff_base
+        self.stable_seconds = config.get('stable_seconds', 600)
+        # 请求子进程退出后等待的秒数，超时强制结束
+        self.stop_timeout = config.get('stop_timeout_seconds', 60)
+        self.check_interval = config.get('check_interval_seconds', 5)
+        output_dir = os.path.join(BASE_DIR, 'logs', 'console')
+        os.makedirs(output_dir, exist_ok=True)
+        self.output = AsyncLogWriter(
+            output_dir,
+            max_bytes=config.get('output_max_bytes', 10 * 1024 * 1024),
+            echo=False
+        )
+        self.process = None
+        self.stopping = threading.Event()
+        self.failures = 0
+
+    def start_child(self):
+        """启动监控程序，有上一个进程的心跳时交给它恢复调度状态
+
+        监控程序的日志已写入 logs/<日期>.log，这里关闭它的控制台输出，
+        logs/console/ 中只保留日志之外的输出（启动信息、未捕获的异常等）。
+        """
+        command = [sys.executable, self.script, '--heartbeat', self.heartbeat_path, '--no-console']
+        if os.path.exists(self.heartbeat_path):
+            command += ['--resume', self.heartbeat_path]
+        env = dict(os.environ, PYTHONUNBUFFERED='1', PYTHONIOENCODING='utf-8')
+        self.process = subprocess.Popen(
+            command,
+            cwd=BASE_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            encoding='utf-8',
+            errors='replace'
+        )
+        reader = threading.Thread(target=self.pump_output, args=(self.process,), name="child-output", daemon=True)
+        reader.start()
+        return reader
+
+    def pump_output(self, process):
+        """逐行把子进程的输出写入日志文件，直到管道关闭"""
+        while True:
+            line = process.stdout.readline(self.MAX_LINE_CHARS)
+            if not line:
+                break
+            self.output.write(time.strftime('%Y-%m-%d'), line.rstrip('\n'))
+        process.stdout.close()
+
+    def read_heartbeat(self):
+        """读取当前子进程写入的心跳，没有或不属于当前子进程时返回 None"""
+        try:
+            with open(self.heartbeat_path, 'r', encoding='utf-8') as f:
+                heartbeat = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if heartbeat.get('pid') != self.process.pid:
+            return None
+        return heartbeat
+
+    def stop_child(self, reason):
+        """请求子进程正常退出，超时后强制结束"""
+        if self.process.poll() is not None:
+            return
+        logging.warning(f"Stopping WeChatMonitor (pid {self.process.pid}): {reason}")
+        self.process.terminate()
         try:
-            logging.info("Starting WeChatMonitor...")
-            
-            # 启动监控程序
-            process = subprocess.Popen([sys.executable, 'wechat_monitor.py'],
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-            
-            # 等待程序结束
-            stdout, stderr = process.communicate()
-            
-            # 如果程序异常退出
-            if process.returncode != 0:
-                logging.error(f"WeChatMonitor crashed with error code {process.returncode}")
-                logging.error(f"Error output: {stderr.decode('utf-8')}")
-                logging.info("Restarting in 30 seconds...")
-                time.sleep(30)  # 等待30秒后重启
-            else:
-                logging.info("WeChatMonitor exited normally")
-                
-        except Exception as e:
-            logging.error(f"Daemon error: {e}")
-            logging.info("Restarting in 30 seconds...")
-            time.sleep(30)
+            self.process.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            logging.error(f"WeChatMonitor did not exit within {self.stop_timeout} seconds, killing it")
+            self.process.kill()
+            self.process.wait()
+
+    def watch_child(self):
+        """等待子进程退出，期间检查心跳；返回退出码"""
+        started = time.time()
+        last_beat = started
+        ready = False
+        while self.process.poll() is None:
+            if self.stopping.wait(self.check_interval):
+                self.stop_child("supervisor shutting down")
+                break
+            heartbeat = self.read_heartbeat()
+            now = time.time()
+            if heartbeat is not None:
+                last_beat = heartbeat['ts']
+                if heartbeat.get('ready') and not ready:
+                    ready = True
+                    logging.info(f"WeChatMonitor is ready after {now - started:.0f} seconds")
+            # 就绪前后都应按时写心跳
+            if now - last_beat > self.liveness_timeout:
+                self.stop_child(f"no heartbeat for {now - last_beat:.0f} seconds")
+            elif not ready and now - started > self.startup_timeout:
+                self.stop_child(f"not ready after {self.startup_timeout} seconds")
+        return self.process.wait()
+
+    def next_delay(self, runtime):
+        """计算重启前的等待时间：运行时间足够长时重置，否则按连续失败次数指数增长"""
+        if runtime >= self.stable_seconds:
+            self.failures = 0
+        else:
+            self.failures += 1
+        return min(self.backoff_max, self.backoff_base * 2 ** max(0, self.failures - 1))
+
+    def handle_signal(self, signum, frame):
+        logging.info(f"Received signal {signum}, shutting down...")
+        self.stopping.set()
+
+    def run(self):
+        """运行监控程序，并在崩溃或卡住时自动重启"""
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        while not self.stopping.is_set():
+            try:
+                logging.info("Starting WeChatMonitor...")
+                started = time.time()
+                reader = self.start_child()
+                returncode = self.watch_child()
+                reader.join(10)
+                runtime = time.time() - started
+
+                if self.stopping.is_set():
+                    logging.info(f"WeChatMonitor stopped with exit code {returncode}")
+                    break
+                if returncode != 0:
+                    logging.error(f"WeChatMonitor exited with code {returncode} after {runtime:.0f} seconds "
+                                  f"(output in logs/console/)")
+                else:
+                    logging.info(f"WeChatMonitor exited normally after {runtime:.0f} seconds")
+                delay = self.next_delay(runtime)
+            except Exception as e:
+                logging.error(f"Daemon error: {e}")
+                delay = self.next_delay(0)
+            logging.info(f"Restarting in {delay:.0f} seconds...")
+            self.stopping.wait(delay)
+        self.output.close()
+
+
+def load_supervisor_config(config_path):
+    """读取 config.json 中的 supervisor 配置，读取失败时使用默认值"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('supervisor', {})
+    except Exception as e:
+        logging.error(f"Error loading supervisor config: {e}")
+        return {}
+
 
 if __name__ == "__main__":
-    run_monitor() 
\ No newline at end of file
+    Supervisor(load_supervisor_config(os.path.join(BASE_DIR, 'config.json'))).run()
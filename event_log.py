@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import json
+import time
+
+
+class EventLog:
+    """结构化事件日志（JSON Lines）
+
+    每个事件一行JSON，包含时间戳 ts（秒）、事件类型 event 和事件字段，例如：
+        {"ts": 1741857599.12, "event": "list_fetched", "account": "...", "articles": 1, "bytes": 2048, "duration_ms": 183.2}
+
+    事件类型：
+        list_fetched     请求了一页文章列表（account, begin, count, status, ret, articles, bytes, duration_ms）
+        content_fetched  获取了文章正文（account, article_key, status, bytes, duration_ms）
+        article_seen     第一次检查一篇文章（account, article_key, title, publish_time, skipped）
+        content_parsed   解析了文章正文（account, article_key, chars, duration_ms）
+        keywords_scanned 扫描了文章中的关键词（account, article_key, chars, matches, duration_ms）
+        match            文章命中关键词（account, article_key, keywords）
+        alert_queued     提醒写入待发队列（account, article_key, spool_id, recipients, held）
+        email_sent       一条队列邮件发送完成（kind, spool_id, account, article_key, recipients, attempt, duration_ms）
+        email_failed     一条队列邮件有收件人发送失败（同上，另有 failed, retry_in）
+        smtp_sent        一次SMTP发送（sender, recipients, ok, duration_ms），一条队列邮件可能包含多次
+        poll_completed   一个公众号抓取完成（account, articles, matches, complete, duration_ms）
+
+    由 AsyncLogWriter 在后台线程中写入，同时交给注册的监听器（例如指标统计）；
+    既没有写入器也没有监听器时 emit 不做任何事。
+    """
+
+    def __init__(self, writer=None):
+        """
+        Args:
+            writer: AsyncLogWriter 实例，为 None 时不写入文件
+        """
+        self.writer = writer
+        self.listeners = []
+
+    @property
+    def enabled(self):
+        return self.writer is not None or bool(self.listeners)
+
+    def add_listener(self, listener):
+        """注册监听器，每个事件以字典形式传给它（在产生事件的线程中调用）"""
+        self.listeners.append(listener)
+
+    def emit(self, event, **fields):
+        """记录一个事件"""
+        if self.writer is None and not self.listeners:
+            return
+        now = time.time()
+        record = {"ts": round(now, 3), "event": event}
+        record.update(fields)
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                print(f"Error in event listener: {e}")
+        if self.writer is None:
+            return
+        self.writer.write(
+            time.strftime("%Y-%m-%d", time.localtime(now)),
+            json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        )
+
+    def flush(self):
+        """等待已记录的事件写入磁盘"""
+        if self.writer is not None:
+            self.writer.flush()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import os
+
+
+class FileWatcher:
+    """通过轮询 stat 检测文件变化
+
+    记录每个文件的 (修改时间, 大小)，与上次检查时不同即视为已修改。
+    文件暂时不存在（例如编辑器保存时先删除再写入）不算修改。
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.signatures = {path: self._signature(path) for path in self.paths}
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def changed(self):
+        """返回自上次检查以来被修改的文件，并记下它们的新状态"""
+        changed = []
+        for path in self.paths:
+            signature = self._signature(path)
+            if signature is not None and signature != self.signatures[path]:
+                self.signatures[path] = signature
+                changed.append(path)
+        return changed
+
+    def acknowledge(self, path):
+        """记下文件的当前状态（程序自己写入文件后调用，避免触发重新加载）"""
+        self.signatures[path] = self._signature(path)
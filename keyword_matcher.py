@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import re
+from collections import deque
+
+
+class KeywordMatcher:
+    """基于 Aho-Corasick 自动机的多关键词匹配器
+
+    在加载配置时由关键词列表构建一次，之后对每段文本只需单次扫描即可找出
+    所有命中的关键词及其位置，扫描耗时与关键词数量基本无关。
+    """
+
+    # 关键词不多于此数量时，find() 直接用 C 实现的子串查找更快（见 bench_keywords.py）
+    SUBSTRING_SEARCH_LIMIT = 8
+
+    def __init__(self, keywords):
+        # 去重并保持配置中的顺序
+        self.keywords = [k for k in dict.fromkeys(keywords) if k]
+        self.keyword_index = {keyword: index for index, keyword in enumerate(self.keywords)}
+        # 每个状态的转移表、失败指针和输出（命中的关键词下标）
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        # 关键词不可能跨越字母表以外的字符，先用正则（C实现）找出只由
+        # 关键词字符组成的片段，自动机只需扫描这些片段
+        alphabet = sorted(set(''.join(self.keywords)))
+        self.segment_pattern = re.compile('[' + ''.join(re.escape(c) for c in alphabet) + ']+') if alphabet else None
+        self._build()
+
+    def _build(self):
+        """构建字典树并用广度优先遍历计算失败指针"""
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                # 合并失败链上的输出，扫描时无需再沿失败链查找
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """逐个产出 (关键词, 起始位置, 结束位置)"""
+        if self.segment_pattern is None:
+            return
+        goto, fail, output, keywords = self.goto, self.fail, self.output, self.keywords
+        for segment in self.segment_pattern.finditer(text):
+            offset = segment.start()
+            state = 0
+            for position, char in enumerate(segment.group(), offset):
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                for index in output[state]:
+                    keyword = keywords[index]
+                    yield keyword, position - len(keyword) + 1, position + 1
+
+    def find_all(self, text):
+        """返回所有命中的关键词及其位置
+
+        Returns:
+            dict: 关键词 -> [(起始位置, 结束位置), ...]
+        """
+        matches = {}
+        if not text:
+            return matches
+        for keyword, start, end in self.iter_matches(text):
+            matches.setdefault(keyword, []).append((start, end))
+        return matches
+
+    def find(self, text):
+        """返回命中的关键词列表，按配置中的顺序排列"""
+        if not text:
+            return []
+        if len(self.keywords) <= self.SUBSTRING_SEARCH_LIMIT:
+            return [keyword for keyword in self.keywords if keyword in text]
+        return sorted(self.find_all(text), key=self.keyword_index.get)
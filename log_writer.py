@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import atexit
+import glob
+import gzip
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+
+
+# 日志级别，低于配置级别的日志不会写入
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+
+def log_file_pattern(extension='.log'):
+    """日志文件名的正则：当天正在写入的 2025-01-01.log，按大小切分出的 2025-01-01.1.log，
+    以及压缩后的 *.log.gz
+    """
+    return re.compile(r"^(\d{4}-\d{2}-\d{2})(?:\.(\d+))?" + re.escape(extension) + r"(\.gz)?$")
+
+
+def list_log_files(log_dir, extension='.log'):
+    """按时间顺序列出日志目录中的日志文件（含压缩文件）
+
+    同一天中按大小切分出的文件在前，当天正在写入的文件在最后。
+    """
+    pattern = log_file_pattern(extension)
+    files = []
+    for path in glob.glob(os.path.join(log_dir, "*" + extension + "*")):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            part = int(match.group(2)) if match.group(2) else float('inf')
+            files.append(((match.group(1), part), path))
+    return [path for _, path in sorted(files)]
+
+
+def open_log_file(path):
+    """以文本方式打开日志文件，自动识别gzip压缩
+
+    列出文件之后原文件可能已被写入线程压缩（先写完 .gz 再删除原文件），这时改为打开压缩文件。
+
+    Raises:
+        FileNotFoundError: 原文件和压缩文件都不存在（例如已被删除）
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='ignore')
+    try:
+        return open(path, 'r', encoding='utf-8', errors='ignore')
+    except FileNotFoundError:
+        return gzip.open(path + '.gz', 'rt', encoding='utf-8', errors='ignore')
+
+
+def compress_file(path):
+    """把文件压缩为 path.gz 并删除原文件
+
+    先写入临时文件再改名，读取方看到的 .gz 总是完整的。
+    """
+    tmp_path = path + '.gz.tmp'
+    with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp_path, path + '.gz')
+    os.remove(path)
+
+
+class AsyncLogWriter:
+    """在后台线程中批量写入日志
+
+    调用方只把日志行放进队列，不做任何文件I/O。后台线程保持当天的日志文件打开，
+    一次取出队列中的所有日志行写入，距上次刷新超过 flush_interval 秒才刷新到磁盘。
+    日期变化时切换到新文件；单个文件超过 max_bytes 时切分出 <日期>.<序号>.log。
+    开启压缩时，切分出的文件和（运行中日期切换后）前一天的文件会压缩为 .gz；
+    启动前已有的日志不做处理。
+    """
+
+    def __init__(self, log_dir, max_bytes=10 * 1024 * 1024, flush_interval=1.0,
+                 batch_size=500, compress=True, echo=True, extension='.log'):
+        """
+        Args:
+            log_dir: 日志目录
+            max_bytes: 单个日志文件的最大字节数，0表示不按大小切分
+            flush_interval: 两次刷新到磁盘之间的最长间隔（秒）
+            batch_size: 一次最多写入的日志行数
+            compress: 是否压缩切分出的文件和日期切换前一天的文件
+            echo: 是否同时输出到标准输出
+            extension: 日志文件扩展名
+        """
+        self.log_dir = log_dir
+        self.extension = extension
+        self.pattern = log_file_pattern(extension)
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, int(batch_size))
+        self.compress = compress
+        self.echo = echo
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.day = None
+        self.size = 0
+        self.dirty = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, day, line):
+        """把一行日志放进写入队列
+
+        Args:
+            day: 日志所属日期（YYYY-MM-DD），决定写入哪个文件
+            line: 日志内容（不含换行）
+        """
+        self.queue.put((day, line))
+
+    def flush(self, timeout=5):
+        """等待队列中已有的日志写入并刷新到磁盘"""
+        if self.closed:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout=5):
+        """写完队列中的日志后关闭文件"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval if self.dirty else None)
+            except queue.Empty:
+                self._flush()
+                last_flush = time.monotonic()
+                continue
+
+            # 一次取出已在队列中的日志，合并成一次写入
+            items = [item]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            waiters = []
+            stop = False
+            lines = []
+            for item in items:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    lines.append(item)
+            try:
+                self._write_lines(lines)
+            except Exception as e:
+                print(f"Error writing log: {e}", file=sys.stderr)
+
+            if waiters or stop or time.monotonic() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                if self.file:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _write_lines(self, lines):
+        """写入一批日志行，同一文件的连续行合并为一次写入"""
+        if self.echo and lines:
+            sys.stdout.write("".join(line + "\n" for _, line in lines))
+        chunk = []
+        for day, line in lines:
+            # 日期切换后才到达的前一天的日志写入当天的文件，前一天的文件已压缩，不再重新打开
+            if self.day is not None and day < self.day:
+                day = self.day
+            if day != self.day:
+                self._write_chunk(chunk)
+                chunk = []
+                self._open(day)
+            chunk.append(line + "\n")
+        self._write_chunk(chunk)
+
+    def _write_chunk(self, chunk):
+        if not chunk:
+            return
+        data = "".join(chunk)
+        self.file.write(data)
+        self.size += len(data.encode('utf-8'))
+        self.dirty = True
+        if self.max_bytes and self.size >= self.max_bytes:
+            self._rotate()
+
+    def _flush(self):
+        if self.echo:
+            sys.stdout.flush()
+        if self.file and self.dirty:
+            self.file.flush()
+        self.dirty = False
+
+    def _path(self, day, part=None):
+        name = f"{day}{self.extension}" if part is None else f"{day}.{part}{self.extension}"
+        return os.path.join(self.log_dir, name)
+
+    def _open(self, day):
+        """切换到某一天的日志文件；日期向后切换时压缩刚结束的那一天"""
+        if self.file:
+            self.file.close()
+        previous = self.day
+        self.day = day
+        self.file = open(self._path(day), 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        if self.compress and previous is not None and previous < day:
+            self._compress_day(previous)
+
+    def _rotate(self):
+        """当前文件超过大小上限，改名为下一个序号并重新打开"""
+        self.file.close()
+        part = 1
+        while any(os.path.exists(self._path(self.day, part) + suffix) for suffix in ('', '.gz')):
+            part += 1
+        rotated = self._path(self.day, part)
+        os.replace(self._path(self.day), rotated)
+        if self.compress:
+            self._compress(rotated)
+        self.file = open(self._path(self.day), 'a', encoding='utf-8')
+        self.size = 0
+
+    def _compress_day(self, day):
+        """压缩某一天尚未压缩的日志文件"""
+        for path in list_log_files(self.log_dir, self.extension):
+            match = self.pattern.match(os.path.basename(path))
+            if match.group(1) == day and not match.group(3):
+                self._compress(path)
+
+    def _compress(self, path):
+        try:
+            compress_file(path)
+        except Exception as e:
+            print(f"Error compressing log {path}: {e}", file=sys.stderr)
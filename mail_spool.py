@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import json
+import sqlite3
+import threading
+import time
+
+
+class MailSpool:
+    """持久化的待发邮件队列（SQLite）
+
+    提醒和欢迎邮件先写入队列再由后台任务发送，进程崩溃或重启后未发完的邮件仍在队列中。
+    每条记录的状态：
+        held     汇总模式下暂存，等待本轮结束或汇总窗口到期
+        pending  等待发送（next_attempt_at 之后）
+        sending  已被取出正在发送；启动时会恢复为 pending
+        sent     全部收件人发送成功
+        failed   重试次数用尽
+    """
+
+    def __init__(self, db_path, max_attempts=8, base_delay=30, max_delay=3600):
+        """
+        Args:
+            db_path: 数据库路径
+            max_attempts: 最大发送次数
+            base_delay: 第一次重试前的等待秒数，之后按指数增长
+            max_delay: 重试等待的上限（秒）
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_error TEXT,
+                dedupe_key TEXT
+            )"""
+        )
+        # 早期版本的表没有 dedupe_key 列
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]
+        if 'dedupe_key' not in columns:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN dedupe_key TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_dedupe ON outbox (kind, dedupe_key)")
+        self.conn.commit()
+        self.recover()
+
+    def recover(self):
+        """把上次进程退出时正在发送的记录恢复为待发送
+
+        Returns:
+            int: 恢复的记录数
+        """
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE outbox SET status = 'pending' WHERE status = 'sending'"
+            ).rowcount
+
+    def enqueue(self, kind, payload, hold=False, dedupe_key=None):
+        """加入一封待发邮件
+
+        Args:
+            kind: 邮件类型（alert/welcome）
+            payload: 可JSON序列化的邮件内容
+            hold: 是否暂存（汇总模式），暂存的记录需要 release_held 后才会发送
+            dedupe_key: 去重键（如文章键），同类型同键的记录已存在时不再加入
+
+        Returns:
+            int: 记录ID；因重复未加入时返回 None
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            if dedupe_key is not None and self.conn.execute(
+                "SELECT 1 FROM outbox WHERE kind = ? AND dedupe_key = ?", (kind, dedupe_key)
+            ).fetchone():
+                return None
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (kind, payload, status, next_attempt_at, created_at, dedupe_key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), 'held' if hold else 'pending', now, now, dedupe_key)
+            )
+            return cursor.lastrowid
+
+    def release_held(self, window_seconds=0):
+        """最早一条暂存记录已等待超过 window_seconds 时，把所有暂存记录转为待发送
+
+        Returns:
+            int: 转为待发送的记录数
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            oldest = self.conn.execute("SELECT MIN(created_at) FROM outbox WHERE status = 'held'").fetchone()[0]
+            if oldest is None or now - oldest < window_seconds:
+                return 0
+            return self.conn.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE status = 'held'", (now,)
+            ).rowcount
+
+    def claim_due(self, limit, kind=None):
+        """取出已到发送时间的记录并标记为发送中
+
+        Returns:
+            list: (id, kind, payload, attempts) 列表
+        """
+        now = time.time()
+        query = "SELECT id, kind, payload, attempts FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?"
+        params = [now]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        query += " ORDER BY next_attempt_at LIMIT ?"
+        params.append(limit)
+        with self.lock, self.conn:
+            rows = self.conn.execute(query, params).fetchall()
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1 WHERE id = ?",
+                [(row[0],) for row in rows]
+            )
+        return [(row[0], row[1], json.loads(row[2]), row[3] + 1) for row in rows]
+
+    def mark_sent(self, item_id):
+        """标记为发送完成"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE outbox SET status = 'sent', last_error = NULL WHERE id = ?", (item_id,))
+
+    def mark_retry(self, item_id, attempts, error, payload=None):
+        """发送失败，按指数退避安排重试；超过最大次数后标记为失败
+
+        Args:
+            payload: 更新后的内容（例如只保留发送失败的收件人）
+
+        Returns:
+            float: 下次重试的等待秒数；已放弃时返回 None
+        """
+        with self.lock, self.conn:
+            if attempts >= self.max_attempts:
+                self.conn.execute(
+                    "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (str(error), item_id)
+                )
+                return None
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            self.conn.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay, str(error), item_id)
+            )
+            if payload is not None:
+                self.conn.execute(
+                    "UPDATE outbox SET payload = ? WHERE id = ?",
+                    (json.dumps(payload, ensure_ascii=False), item_id)
+                )
+            return delay
+
+    def next_due_in(self):
+        """距最早一条待发送记录到期的秒数，没有待发送记录时返回 None"""
+        with self.lock:
+            earliest = self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+        return None if earliest is None else max(0.0, earliest - time.time())
+
+    def counts(self):
+        """各状态的记录数"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def purge_finished(self, older_than_seconds):
+        """删除早于指定时间的已发送和已放弃（failed）记录"""
+        cutoff = time.time() - older_than_seconds
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?", (cutoff,)
+            ).rowcount
+
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.conn.close()
+
+
+class DeliveryLedger:
+    """记录每个收件人已收到哪些邮件的发送账本（SQLite）
+
+    以 (文章键, 收件人, 模板) 为主键，发送前过滤掉已收到的收件人，发送成功后逐个记录。
+    重试或重启后恢复的发送只会发给仍未收到的收件人，不会重复发送。
+    欢迎邮件没有对应的文章，文章键为空字符串。
+    """
+
+    QUERY_CHUNK = 500
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS deliveries (
+                article_key TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                template TEXT NOT NULL,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (article_key, recipient, template)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_sent_at ON deliveries (sent_at)")
+        self.conn.commit()
+
+    def undelivered(self, article_key, template, recipients):
+        """返回尚未收到该邮件的收件人（保持原顺序）"""
+        recipients = list(recipients)
+        delivered = set()
+        with self.lock:
+            # 分批查询，避免超过SQLite的参数个数上限
+            for i in range(0, len(recipients), self.QUERY_CHUNK):
+                chunk = recipients[i:i + self.QUERY_CHUNK]
+                delivered.update(row[0] for row in self.conn.execute(
+                    "SELECT recipient FROM deliveries WHERE article_key = ? AND template = ? AND recipient IN (%s)"
+                    % ",".join("?" * len(chunk)),
+                    [article_key, template] + chunk
+                ))
+        return [recipient for recipient in recipients if recipient not in delivered]
+
+    def record(self, article_key, template, recipients):
+        """记录发送成功的收件人"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO deliveries (article_key, recipient, template, sent_at) VALUES (?, ?, ?, ?)",
+                [(article_key, recipient, template, now) for recipient in recipients]
+            )
+
+    def purge_older_than(self, older_than_seconds, template):
+        """删除早于指定时间的某类记录（文章过了时效窗口后不会再触发提醒）"""
+        cutoff = time.time() - older_than_seconds
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "DELETE FROM deliveries WHERE template = ? AND sent_at < ?", (template, cutoff)
+            ).rowcount
+
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import os
+import threading
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+
+
+# 内联图片在邮件中的 Content-ID
+IMAGE_CID = 'attached_image'
+
+
+class InlineImageCache:
+    """内联图片MIME部件缓存
+
+    图片只在首次使用或文件修改时间变化时读取并做base64编码，
+    之后所有邮件共享同一个 MIMEImage 部件。
+    """
+
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.part = None
+
+    def get(self):
+        """返回内联图片部件，图片不存在或读取失败时返回 None"""
+        try:
+            mtime = os.stat(self.image_path).st_mtime
+        except OSError:
+            return None
+        with self.lock:
+            if self.part is None or mtime != self.mtime:
+                with open(self.image_path, "rb") as img_file:
+                    img = MIMEImage(img_file.read())
+                img.add_header('Content-ID', f'<{IMAGE_CID}>')
+                img.add_header('Content-Disposition', 'inline', filename=os.path.basename(self.image_path))
+                self.part = img
+                self.mtime = mtime
+            return self.part
+
+
+def html_part(html_content):
+    """把渲染好的HTML编码成可在多封邮件间共享的MIME部件"""
+    return MIMEText(html_content, 'html', 'utf-8')
+
+
+def build_message(sender, recipient, subject, parts):
+    """组装一封邮件：只生成每个收件人独有的头部，正文和图片部件直接复用"""
+    msg = MIMEMultipart()
+    msg['From'] = formataddr(["WecountsMonitor", sender])
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    for part in parts:
+        if part is not None:
+            msg.attach(part)
+    return msg
+
+
+def render_alert_html(article_data, keywords, monitor_time, img_cid=None):
+    """渲染关键词提醒邮件正文（每次提醒渲染一次，所有收件人共用）"""
+    return f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background-color: #f8f9fa; padding: 10px; border-bottom: 1px solid #e9ecef; }}
+            .footer {{ margin-top: 20px; font-size: 12px; color: #6c757d; }}
+            .highlight {{ background-color: yellow; font-weight: bold; }}
+            .image-container {{ text-align: center; margin: 20px 0; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h2>{article_data['title']}</h2>
+                <p>作者: {article_data['author']}</p>
+            </div>
+            <div class="content">
+                <p>在文章《{article_data['title']}》中发现关键词: <span class="highlight">{', '.join(keywords)}</span></p>
+                <p>文章链接: <a href="{article_data['url']}">{article_data['url']}</a></p>
+                <p>监控时间: {monitor_time}</p>
+                <p>有疑问扫码咨询</p>
+                {f'<div class="image-container"><img src="cid:{img_cid}" alt="附图" style="max-width:100%;"></div>' if img_cid else ''}
+            </div>
+            <div class="footer">
+                <p>此邮件由WecountsMonitor自动发送，请勿回复。</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def render_digest_html(items, monitor_time, img_cid=None):
+    """渲染汇总提醒邮件正文
+
+    Args:
+        items: (article_data, keywords) 列表
+    """
+    articles_html = ''.join(f"""
+                <div class="article">
+                    <h3>{article_data['title']}</h3>
+                    <p>作者: {article_data['author']}</p>
+                    <p>发现关键词: <span class="highlight">{', '.join(keywords)}</span></p>
+                    <p>文章链接: <a href="{article_data['url']}">{article_data['url']}</a></p>
+                </div>""" for article_data, keywords in items)
+    return f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background-color: #f8f9fa; padding: 10px; border-bottom: 1px solid #e9ecef; }}
+            .article {{ padding: 10px 0; border-bottom: 1px solid #e9ecef; }}
+            .footer {{ margin-top: 20px; font-size: 12px; color: #6c757d; }}
+            .highlight {{ background-color: yellow; font-weight: bold; }}
+            .image-container {{ text-align: center; margin: 20px 0; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h2>发现 {len(items)} 篇包含关键词的文章</h2>
+            </div>
+            <div class="content">{articles_html}
+                <p>监控时间: {monitor_time}</p>
+                <p>有疑问扫码咨询</p>
+                {f'<div class="image-container"><img src="cid:{img_cid}" alt="附图" style="max-width:100%;"></div>' if img_cid else ''}
+            </div>
+            <div class="footer">
+                <p>此邮件由WecountsMonitor自动发送，请勿回复。</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def render_welcome_html(img_cid=None):
+    """渲染欢迎邮件正文（内容固定，可长期缓存）"""
+    return f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background-color: #f8f9fa; padding: 10px; border-bottom: 1px solid #e9ecef; }}
+            .content {{ padding: 20px 0; }}
+            .footer {{ margin-top: 20px; font-size: 12px; color: #6c757d; }}
+            .image-container {{ text-align: center; margin: 20px 0; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h2>WecountsMonitor注册成功</h2>
+            </div>
+            <div class="content">
+                <p>致 RUCer，</p>
+                <p><strong>收到该邮件证明您的邮箱已加入WecountsMonitor的提醒列表。</strong></p>
+                <p>欢迎大家使用免费开源的WecountsMonitor，该服务主要是为了方便大家火速报名形势与政策讲座 & 志愿活动，帮助高年级同学顺利毕业写的！</p>
+                <p>🌟 如果任何bug / 接收不到邮件 / 改进建议，欢迎扫描附件二维码加入反馈群进行吐槽。如果有其他开发建议或insights，也欢迎加入"WecountsMonitor"群聊进行讨论～ 🌟</p>
+                <p>来自WecountsMonitor开发组</p>
+                {f'<div class="image-container"><img src="cid:{img_cid}" alt="二维码" style="max-width:100%;"></div>' if img_cid else ''}
+            </div>
+            <div class="footer">
+                <p>（此邮件由WecountsMonitor自动发送，请勿回复）</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import bisect
+import threading
+
+
+# 默认的延迟直方图分桶（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 解析和关键词匹配等进程内操作的分桶（秒）
+CPU_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，按标签分别计数"""
+
+    TYPE = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Histogram:
+    """按标签分别统计的累积分桶直方图"""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.values = {}  # 标签 -> [各分桶计数, 总和, 总数]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标集合，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def on_collect(self, callback):
+        """注册在每次输出前调用的回调，用于刷新按需计算的 Gauge"""
+        self.collectors.append(callback)
+
+    def render(self):
+        for callback in self.collectors:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MonitorMetrics:
+    """监控程序的指标，由结构化事件（见 event_log.py）驱动更新"""
+
+    # 微信接口返回码
+    RET_TOKEN_EXPIRED = 200002
+    RET_FREQ_CONTROL = 200013
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.requests = r.counter(
+            "wecounts_requests_total", "HTTP requests to WeChat by kind, account and result",
+            ("kind", "account", "result"))
+        self.response_bytes = r.counter(
+            "wecounts_response_bytes_total", "Response bytes received from WeChat", ("kind", "account"))
+        self.request_duration = r.histogram(
+            "wecounts_request_duration_seconds", "WeChat request latency", ("kind", "account"))
+        self.api_errors = r.counter(
+            "wecounts_api_errors_total", "Non-zero ret codes from the article list API (200002 = token expired)",
+            ("account", "ret"))
+        self.poll_duration = r.histogram(
+            "wecounts_poll_duration_seconds", "Time to poll one account including content fetches", ("account",))
+        self.parse_duration = r.histogram(
+            "wecounts_parse_duration_seconds", "Time to parse one article page with lxml", ("account",),
+            buckets=CPU_BUCKETS)
+        self.match_duration = r.histogram(
+            "wecounts_match_duration_seconds", "Time to scan one article for keywords", ("account",),
+            buckets=CPU_BUCKETS)
+        self.articles_seen = r.counter(
+            "wecounts_articles_seen_total", "New articles checked", ("account", "skipped"))
+        self.matches = r.counter(
+            "wecounts_matches_total", "Articles matching at least one keyword", ("account",))
+        self.alerts_queued = r.counter(
+            "wecounts_alerts_queued_total", "Alerts written to the mail spool", ("account",))
+        self.emails_sent = r.counter(
+            "wecounts_emails_sent_total", "Recipients successfully sent a spooled email", ("kind",))
+        self.emails_failed = r.counter(
+            "wecounts_emails_failed_total", "Recipients whose spooled email failed on an attempt", ("kind",))
+        self.email_duration = r.histogram(
+            "wecounts_email_delivery_duration_seconds", "Time to deliver one spooled email to all its recipients",
+            ("kind",))
+        self.smtp_duration = r.histogram(
+            "wecounts_smtp_send_duration_seconds", "Time of one SMTP send by sender account and result",
+            ("sender", "result"))
+        # 以下 Gauge 由调用方通过 registry.on_collect 在输出前刷新
+        self.spool_items = r.gauge("wecounts_spool_items", "Mail spool rows by status", ("status",))
+        self.sender_usage = r.gauge(
+            "wecounts_sender_usage", "Recipients sent per sender account in the last 24 hours", ("sender",))
+
+    def observe(self, record):
+        """根据一个结构化事件更新指标"""
+        event = record.get('event')
+        account = record.get('account') or ''
+        if event in ('list_fetched', 'content_fetched'):
+            kind = 'list' if event == 'list_fetched' else 'content'
+            self.requests.inc(kind=kind, account=account, result=self._result(record))
+            self.response_bytes.inc(record.get('bytes') or 0, kind=kind, account=account)
+            self.request_duration.observe((record.get('duration_ms') or 0) / 1000.0, kind=kind, account=account)
+            if kind == 'list' and record.get('ret') not in (None, 0):
+                self.api_errors.inc(account=account, ret=record['ret'])
+        elif event == 'poll_completed':
+            self.poll_duration.observe((record.get('duration_ms') or 0) / 1000.0, account=account)
+        elif event == 'content_parsed':
+            self.parse_duration.observe((record.get('duration_ms') or 0) / 1000.0, account=account)
+        elif event == 'keywords_scanned':
+            self.match_duration.observe((record.get('duration_ms') or 0) / 1000.0, account=account)
+        elif event == 'smtp_sent':
+            self.smtp_duration.observe((record.get('duration_ms') or 0) / 1000.0, sender=record.get('sender') or '',
+                                       result="ok" if record.get('ok') else "error")
+        elif event == 'article_seen':
+            self.articles_seen.inc(account=account, skipped=record.get('skipped') or '')
+        elif event == 'match':
+            self.matches.inc(account=account)
+        elif event == 'alert_queued':
+            self.alerts_queued.inc(account=account)
+        elif event in ('email_sent', 'email_failed'):
+            kind = record.get('kind') or ''
+            if record.get('recipients'):
+                self.emails_sent.inc(record['recipients'], kind=kind)
+            if record.get('failed'):
+                self.emails_failed.inc(record['failed'], kind=kind)
+            self.email_duration.observe((record.get('duration_ms') or 0) / 1000.0, kind=kind)
+
+    def _result(self, record):
+        ret = record.get('ret')
+        if record.get('status') is None:
+            return "error"
+        if record.get('status') != 200:
+            return "http_error"
+        if ret == self.RET_TOKEN_EXPIRED:
+            return "token_expired"
+        if ret == self.RET_FREQ_CONTROL:
+            return "freq_control"
+        if ret not in (None, 0):
+            return "api_error"
+        return "ok"
+
+
+class MetricsServer:
+    """在后台线程中提供 /metrics 接口（Prometheus 文本格式）"""
+
+    def __init__(self, registry, host="127.0.0.1", port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
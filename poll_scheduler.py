@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import json
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from log_writer import list_log_files, open_log_file
+
+
+class PublishHistory:
+    """各公众号的历史推送时间
+
+    每次推送（同一时间戳的多篇文章算一次）只记录一次，保存在
+    data/publish_history.json 中。首次运行时从 logs/ 下的日志（含压缩日志）中的
+    "Publish time:" 记录回填。
+    """
+
+    # 每个公众号最多保留的推送记录数
+    MAX_EVENTS_PER_ACCOUNT = 500
+
+    FOUND_PATTERN = re.compile(r"^\[[^\]]+\] Found \d+ article for (.+)$")
+    PUBLISH_PATTERN = re.compile(r"^\[[^\]]+\] Publish time: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})$")
+
+    def __init__(self, history_path, log_dir=None):
+        self.history_path = history_path
+        self.lock = threading.Lock()
+        self.events = self.load()
+        if not self.events and log_dir:
+            self.events = self.backfill_from_logs(log_dir)
+            if self.events:
+                self.save()
+
+    def load(self):
+        """加载历史推送时间"""
+        if os.path.exists(self.history_path):
+            try:
+                with open(self.history_path, 'r', encoding='utf-8') as f:
+                    return {account: sorted(set(ts)) for account, ts in json.load(f).items()}
+            except Exception as e:
+                print(f"Error loading publish history: {e}")
+        return {}
+
+    def save(self):
+        """保存历史推送时间"""
+        try:
+            with self.lock:
+                snapshot = {account: list(ts) for account, ts in self.events.items()}
+            with open(self.history_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"Error saving publish history: {e}")
+
+    def backfill_from_logs(self, log_dir):
+        """从监控日志中回填历史推送时间"""
+        events = {}
+        for log_file in list_log_files(log_dir):
+            current_account = None
+            try:
+                f = open_log_file(log_file)
+            except FileNotFoundError:
+                # 列出之后被删除
+                continue
+            with f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    found = self.FOUND_PATTERN.match(line)
+                    if found:
+                        current_account = found.group(1)
+                        continue
+                    published = self.PUBLISH_PATTERN.match(line)
+                    if published and current_account:
+                        try:
+                            ts = int(time.mktime(time.strptime(published.group(1), "%Y-%m-%d %H:%M:%S")))
+                        except ValueError:
+                            continue
+                        events.setdefault(current_account, set()).add(ts)
+        result = {}
+        for account, ts in events.items():
+            result[account] = sorted(ts)[-self.MAX_EVENTS_PER_ACCOUNT:]
+        print(f"Backfilled publish history for {len(result)} accounts from {log_dir}")
+        return result
+
+    def record(self, account_name, timestamps):
+        """记录一批推送时间，返回是否有新记录"""
+        with self.lock:
+            known = self.events.setdefault(account_name, [])
+            new_ts = set(timestamps) - set(known)
+            if not new_ts:
+                return False
+            known.extend(new_ts)
+            known.sort()
+            del known[:-self.MAX_EVENTS_PER_ACCOUNT]
+            return True
+
+    def snapshot(self):
+        """返回历史记录的副本"""
+        with self.lock:
+            return {account: list(ts) for account, ts in self.events.items()}
+
+
+class AdaptiveScheduler:
+    """按各公众号发布规律分配轮询预算的调度器
+
+    对每个公众号按一天中的小时统计推送频率 λ(h)，在总轮询次数不变的前提下，
+    让每个（公众号, 小时）的轮询频率与 sqrt(λ) 成正比——对周期性轮询的泊松到达，
+    这能使平均检测延迟最小。下一次轮询的时间是从当前时刻起累计轮询频率达到1的时刻，
+    因此冷门时段的长间隔不会跨过即将到来的发布高峰。
+    """
+
+    HOURS = 24
+
+    def __init__(self, accounts, history, polls_per_day, min_interval_minutes=10, max_interval_hours=12):
+        """
+        Args:
+            accounts: 要调度的公众号列表
+            history: PublishHistory 实例
+            polls_per_day: 所有公众号每天的总轮询次数预算
+            min_interval_minutes: 同一公众号的最短轮询间隔
+            max_interval_hours: 同一公众号的最长轮询间隔
+        """
+        if min_interval_minutes <= 0 or max_interval_hours <= 0:
+            raise ValueError(f"Poll intervals must be positive, got min_interval_minutes={min_interval_minutes}, "
+                             f"max_interval_hours={max_interval_hours}")
+        if min_interval_minutes > max_interval_hours * 60:
+            raise ValueError(f"min_interval_minutes ({min_interval_minutes}) exceeds "
+                             f"max_interval_hours ({max_interval_hours}) * 60")
+        self.history = history
+        self.polls_per_day = float(polls_per_day)
+        self.max_rate = 60.0 / min_interval_minutes  # 每小时最多轮询次数
+        self.min_rate = 1.0 / max_interval_hours  # 每小时最少轮询次数
+        self.lock = threading.Lock()
+        self.accounts = []
+        self.poll_rates = {}
+        self.next_due = {}
+        self.set_accounts(accounts)
+
+    def set_accounts(self, accounts, polls_per_day=None):
+        """更新调度的公众号列表，新公众号立即到期
+
+        Args:
+            polls_per_day: 新的每日总轮询预算，默认不变
+        """
+        with self.lock:
+            if polls_per_day is not None:
+                self.polls_per_day = float(polls_per_day)
+            self.accounts = list(accounts)
+            self.next_due = {account: self.next_due.get(account, 0.0) for account in self.accounts}
+        self.rebuild()
+
+    def publish_rates(self):
+        """估计每个公众号每个小时的期望推送次数 λ(h)（次/天）
+
+        用所有公众号合并的小时分布作为先验（1次伪推送），
+        避免没有历史的公众号或从未发布过的时段被完全忽略。
+        """
+        events = self.history.snapshot()
+        counts = {account: [0] * self.HOURS for account in self.accounts}
+        pooled = [1.0] * self.HOURS
+        first_ts, last_ts = None, None
+        for account, timestamps in events.items():
+            for ts in timestamps:
+                hour = time.localtime(ts).tm_hour
+                pooled[hour] += 1
+                if account in counts:
+                    counts[account][hour] += 1
+                first_ts = ts if first_ts is None else min(first_ts, ts)
+                last_ts = ts if last_ts is None else max(last_ts, ts)
+
+        span_days = max(1.0, (last_ts - first_ts) / 86400.0) if first_ts is not None else 1.0
+        pooled_total = sum(pooled)
+        prior = [p / pooled_total for p in pooled]
+
+        return {
+            account: [(counts[account][h] + prior[h]) / span_days for h in range(self.HOURS)]
+            for account in self.accounts
+        }
+
+    def rebuild(self):
+        """根据历史重新计算各公众号每小时的轮询频率（次/小时）"""
+        with self.lock:
+            accounts = list(self.accounts)
+        if not accounts:
+            return
+        rates = self.publish_rates()
+        weights = {account: [math.sqrt(r) for r in rates[account]] for account in accounts}
+
+        def total_polls(scale):
+            return sum(
+                min(self.max_rate, max(self.min_rate, scale * w))
+                for account in accounts for w in weights[account]
+            )
+
+        # 二分查找缩放系数，使钳位之后的总轮询次数等于预算
+        budget = max(self.polls_per_day, total_polls(0.0))
+        low, high = 0.0, 1.0
+        while total_polls(high) < budget and high < 1e9:
+            high *= 2
+        for _ in range(60):
+            mid = (low + high) / 2
+            if total_polls(mid) < budget:
+                low = mid
+            else:
+                high = mid
+
+        poll_rates = {
+            account: [min(self.max_rate, max(self.min_rate, low * w)) for w in weights[account]]
+            for account in accounts
+        }
+        with self.lock:
+            self.poll_rates = poll_rates
+
+    def interval_after(self, account, now):
+        """从 now 开始累计轮询频率达到1所需的秒数"""
+        with self.lock:
+            rates = self.poll_rates.get(account)
+        if not rates:
+            return 3600.0 / self.min_rate
+
+        credit = 0.0
+        elapsed = 0.0
+        t = now
+        while True:
+            local = time.localtime(t)
+            rate = rates[local.tm_hour]
+            seconds_left_in_hour = 3600 - (local.tm_min * 60 + local.tm_sec)
+            needed = (1.0 - credit) / rate * 3600
+            if needed <= seconds_left_in_hour:
+                return elapsed + needed
+            credit += rate * seconds_left_in_hour / 3600
+            elapsed += seconds_left_in_hour
+            t += seconds_left_in_hour
+
+    def due_accounts(self, now=None):
+        """返回已到期需要轮询的公众号"""
+        now = time.time() if now is None else now
+        with self.lock:
+            return [account for account in self.accounts if self.next_due.get(account, 0.0) <= now]
+
+    def mark_polled(self, account, now=None):
+        """记录一次轮询并安排下一次轮询时间"""
+        now = time.time() if now is None else now
+        next_due = now + self.interval_after(account, now)
+        with self.lock:
+            self.next_due[account] = next_due
+        return next_due
+
+    def next_wakeup(self):
+        """返回最近一个到期时间"""
+        with self.lock:
+            return min(self.next_due.values()) if self.next_due else None
+
+    def snapshot_next_due(self):
+        """返回各公众号下一次轮询时间的副本"""
+        with self.lock:
+            return dict(self.next_due)
+
+    def restore_next_due(self, next_due):
+        """恢复之前的进程记录的下一次轮询时间（只恢复仍在调度中的公众号）"""
+        with self.lock:
+            for account in self.accounts:
+                if account in next_due:
+                    self.next_due[account] = float(next_due[account])
+
+    def format_next_due(self, account):
+        """格式化公众号的下一次轮询时间"""
+        with self.lock:
+            due = self.next_due.get(account)
+        return datetime.fromtimestamp(due).strftime("%Y-%m-%d %H:%M:%S") if due else "now"
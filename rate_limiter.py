@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import threading
+import time
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器
+
+    所有线程共享同一个桶，每次请求前取一个令牌。令牌按 rate 匀速补充，
+    最多积累 capacity 个，因此整体请求速率受预算控制，而与并发线程数无关。
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量，即允许的最大突发请求数
+        """
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute, burst=1):
+        """按每分钟请求数创建限流器"""
+        return cls(requests_per_minute / 60.0, burst)
+
+    def _refill(self, now):
+        """根据流逝的时间补充令牌（调用方需持有锁）"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """非阻塞地尝试取令牌
+
+        Returns:
+            float: 0 表示取得成功，否则为还需等待的秒数
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """阻塞直到取得令牌，限流器关闭时立即返回
+
+        Returns:
+            bool: 是否在超时或关闭前取得令牌
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.closed.is_set():
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            self.closed.wait(wait)
+        return False
+
+    def pause(self, seconds):
+        """暂停发放令牌（例如触发微信频率限制后退避）"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.updated_at = self.paused_until
+
+    def close(self):
+        """关闭限流器：正在等待令牌（包括暂停期间）的线程立即返回 False，之后不再发放令牌"""
+        self.closed.set()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import csv
+import hashlib
+import io
+import json
+import os
+
+
+def normalize_email(value):
+    """规范化邮箱地址（去空白、转小写），无效时返回 None"""
+    if not isinstance(value, str):
+        return None
+    email = value.strip().lower()
+    if not email or '@' not in email or any(c.isspace() for c in email):
+        return None
+    return email
+
+
+class RecipientStore:
+    """带规范化索引的收件人列表
+
+    列表本身（config['email']['recipients']）保持原样，另外维护一个规范化邮箱的集合，
+    判断是否已注册只需一次集合查询，大小写或首尾空白不同的同一邮箱不会重复加入。
+    """
+
+    def __init__(self, recipients):
+        self.recipients = recipients
+        self.index = set()
+        for recipient in recipients:
+            email = normalize_email(recipient)
+            if email:
+                self.index.add(email)
+
+    def __contains__(self, email):
+        return normalize_email(email) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, email):
+        """加入收件人
+
+        Returns:
+            str: 规范化后的邮箱；无效或已存在时返回 None
+        """
+        email = normalize_email(email)
+        if email is None or email in self.index:
+            return None
+        self.index.add(email)
+        self.recipients.append(email)
+        return email
+
+
+class RegistrationReader:
+    """增量读取注册CSV文件
+
+    在状态文件中记住已读取到的字节偏移、文件大小、修改时间和表头的哈希。
+    每次轮询先 stat 文件，大小和修改时间都没变时不打开文件；有变化时只从上次的
+    偏移读取新追加的完整行。文件被截短或表头改变（被整体重写）时从头重新读取。
+    """
+
+    def __init__(self, csv_path, state_path):
+        self.csv_path = csv_path
+        self.state_path = state_path
+        self.state = self.load_state()
+
+    def load_state(self):
+        """加载读取进度"""
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading registration state: {e}")
+        return {}
+
+    def save_state(self):
+        """保存读取进度"""
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"Error saving registration state: {e}")
+
+    def changed(self):
+        """文件自上次读取以来是否有变化（只做一次 stat）"""
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            return False
+        return stat.st_size != self.state.get('size') or stat.st_mtime != self.state.get('mtime')
+
+    def read_new_rows(self):
+        """读取上次之后追加的行
+
+        调用方处理完返回的行后应调用 save_state，中途退出时下次会重新读取这些行。
+
+        Returns:
+            list: 以表头为键的行字典列表
+        """
+        if not self.changed():
+            return []
+        stat = os.stat(self.csv_path)
+
+        with open(self.csv_path, 'rb') as f:
+            header_line = f.readline()
+            header_hash = hashlib.sha1(header_line).hexdigest()
+            offset = self.state.get('offset', 0)
+            if header_hash != self.state.get('header_hash') or offset > stat.st_size or offset < len(header_line):
+                offset = len(header_line)
+            f.seek(offset)
+            data = f.read()
+
+        # 只处理以换行结尾的完整行，最后一行可能仍在写入；
+        # 上次轮询时已看到同样的未完成行且文件没有再增长，说明文件末尾没有换行
+        end = data.rfind(b'\n') + 1
+        if end < len(data) and self.state.get('partial_size') == stat.st_size:
+            end = len(data)
+        header = [name.strip() for name in next(csv.reader([header_line.decode('utf-8-sig')]), [])]
+        text = data[:end].decode('utf-8', errors='replace')
+        rows = [
+            dict(zip(header, values))
+            for values in csv.reader(io.StringIO(text, newline=''))
+            if any(value.strip() for value in values)
+        ]
+
+        self.state = {
+            "offset": offset + end,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "header_hash": header_hash
+        }
+        if end < len(data):
+            # 下次轮询时重新检查未完成的最后一行
+            self.state['size'] = None
+            self.state['partial_size'] = stat.st_size
+        return rows
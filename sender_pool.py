@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+
+# 服务商返回的配额/频率限制错误（如Gmail的 550 5.4.5 Daily sending quota exceeded、421 4.7.28 rate limited），
+# 按增强状态码或配额/频率相关的措辞判断；单独的 limit（如 552 5.3.4 message size exceeds fixed limit）不算
+QUOTA_ERROR_PATTERN = re.compile(
+    r"\b5\.4\.5\b|\b4\.7\.\d+\b|quota|\brate[ -]?limit|\bsending limit|\b(?:daily|hourly) (?:user )?(?:sending )?limit"
+    r"|too many (?:messages|mails|emails|recipients)",
+    re.IGNORECASE
+)
+
+
+def is_quota_error(error):
+    """判断SMTP错误是否表示发件账号触发了配额或频率限制"""
+    code = getattr(error, 'code', None)
+    message = str(getattr(error, 'message', '') or error)
+    return code is not None and code >= 400 and bool(QUOTA_ERROR_PATTERN.search(message))
+
+
+def is_temporary_error(error):
+    """判断SMTP错误是否为4xx临时错误（服务暂不可用、灰名单等），稍后即可重试"""
+    code = getattr(error, 'code', None)
+    return code is not None and 400 <= code < 500
+
+
+class SenderPool:
+    """在多个发件账号之间均衡分配发送量
+
+    按最近24小时的发送量（每个收件人计一次）从少到多排列可用账号，并限制每分钟的发送量。
+    达到每日上限或被服务商限流的账号暂时移出轮换，直到窗口重置；
+    其他4xx临时错误只让账号短暂退避。
+    """
+
+    DAY = 86400
+    MINUTE = 60
+
+    def __init__(self, accounts, daily_limit=500, per_minute_limit=20, cooldown_seconds=3600, backoff_seconds=60,
+                 state_path=None):
+        """
+        Args:
+            accounts: 发件账号列表（包含 username/password）
+            daily_limit: 每个账号24小时内最多发送的收件人数
+            per_minute_limit: 每个账号每分钟最多发送的收件人数
+            cooldown_seconds: 被服务商限流后暂停使用的时间
+            backoff_seconds: 遇到其他4xx临时错误后暂停使用的时间
+            state_path: 发送记录的保存路径，重启后继续统计
+        """
+        self.accounts = list(accounts)
+        self.daily_limit = daily_limit
+        self.per_minute_limit = per_minute_limit
+        self.cooldown_seconds = cooldown_seconds
+        self.backoff_seconds = backoff_seconds
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.sent = {account['username']: deque() for account in self.accounts}
+        # 达到每日上限的账号（撤销预占的发送后可以恢复）和因发送失败暂停的账号分开记录
+        self.limit_until = {}
+        self.cooldown_until = {}
+        self.load()
+
+    def load(self):
+        """加载发送记录"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            print(f"Error loading sender usage: {e}")
+            return
+        cutoff = time.time() - self.DAY
+        for username, timestamps in state.get('sent', {}).items():
+            if username in self.sent:
+                self.sent[username].extend(ts for ts in timestamps if ts > cutoff)
+        # 旧版本的记录保存为 disabled_until，按失败暂停处理
+        cooldowns = state.get('cooldown_until', state.get('disabled_until', {}))
+        self.cooldown_until = {
+            username: until for username, until in cooldowns.items()
+            if username in self.sent and until > time.time()
+        }
+
+    def save(self):
+        """保存发送记录"""
+        if not self.state_path:
+            return
+        with self.lock:
+            state = {
+                "sent": {username: list(timestamps) for username, timestamps in self.sent.items()},
+                "cooldown_until": dict(self.cooldown_until)
+            }
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+        except Exception as e:
+            print(f"Error saving sender usage: {e}")
+
+    def _expire(self, username, now):
+        """丢弃24小时之前的发送记录（调用方需持有锁）"""
+        timestamps = self.sent[username]
+        while timestamps and timestamps[0] <= now - self.DAY:
+            timestamps.popleft()
+
+    def _count_since(self, username, since):
+        count = 0
+        for ts in reversed(self.sent[username]):
+            if ts <= since:
+                break
+            count += 1
+        return count
+
+    def _capacity_wait(self, username, count, now):
+        """账号还需等待多少秒才能发送 count 个收件人，当天无法再发送时返回 None（调用方需持有锁）"""
+        if self.limit_until.get(username, 0) > now or self.cooldown_until.get(username, 0) > now:
+            return None
+        self._expire(username, now)
+        if len(self.sent[username]) + count > self.daily_limit:
+            return None
+        # 单次发送的收件人数超过每分钟上限时（大批量），只要求这一分钟内没有其他发送
+        count = min(count, self.per_minute_limit)
+        recent = self._count_since(username, now - self.MINUTE)
+        if recent + count <= self.per_minute_limit:
+            return 0.0
+        # 等到足够多的记录滑出一分钟窗口
+        timestamps = self.sent[username]
+        overflow = recent + count - self.per_minute_limit
+        return max(0.0, timestamps[len(timestamps) - recent + overflow - 1] + self.MINUTE - now)
+
+    def acquire(self, count=1, exclude=()):
+        """选出发送量最少的可用账号，并预先记下这次发送
+
+        Returns:
+            dict: 发件账号；没有立即可用的账号时返回 None
+        """
+        now = time.time()
+        with self.lock:
+            available = [
+                (len(self.sent[account['username']]), account)
+                for account in self.accounts
+                if account['username'] not in exclude
+                and self._capacity_wait(account['username'], count, now) == 0.0
+            ]
+            if not available:
+                return None
+            _, account = min(available, key=lambda item: item[0])
+            username = account['username']
+            self.sent[username].extend([now] * count)
+            if len(self.sent[username]) >= self.daily_limit:
+                # 到达每日上限，等最早的一条记录滑出窗口后再用
+                self.limit_until[username] = self.sent[username][0] + self.DAY
+            return account
+
+    def wait_time(self, count=1, exclude=()):
+        """最早有账号可用还需等待的秒数，所有账号当天都已不可用时返回 None"""
+        now = time.time()
+        with self.lock:
+            waits = [
+                self._capacity_wait(account['username'], count, now)
+                for account in self.accounts
+                if account['username'] not in exclude
+            ]
+        waits = [wait for wait in waits if wait is not None]
+        return min(waits) if waits else None
+
+    def release(self, username, count=1):
+        """发送失败时撤销 acquire 预先记下的发送
+
+        回到每日上限以下时恢复因达到上限而移出轮换的账号；发送失败导致的暂停不受影响。
+        """
+        with self.lock:
+            timestamps = self.sent[username]
+            for _ in range(min(count, len(timestamps))):
+                timestamps.pop()
+            if len(timestamps) < self.daily_limit:
+                self.limit_until.pop(username, None)
+
+    def record_failure(self, username, error):
+        """记录一次失败：配额/频率限制错误让账号暂停 cooldown_seconds，其他4xx临时错误暂停 backoff_seconds
+
+        Returns:
+            float: 账号暂停使用的秒数；不需要暂停时返回 None
+        """
+        if is_quota_error(error):
+            seconds = self.cooldown_seconds
+        elif is_temporary_error(error):
+            seconds = self.backoff_seconds
+        else:
+            return None
+        with self.lock:
+            self.cooldown_until[username] = max(self.cooldown_until.get(username, 0), time.time() + seconds)
+        return seconds
+
+    def usage(self):
+        """各账号最近24小时的发送量"""
+        now = time.time()
+        with self.lock:
+            for username in self.sent:
+                self._expire(username, now)
+            return {username: len(timestamps) for username, timestamps in self.sent.items()}
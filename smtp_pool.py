@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import asyncio
+import time
+
+
+class PooledConnection:
+    """连接池中的一个已登录SMTP连接"""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """按发件账号复用已登录SMTP连接的连接池
+
+    每个发件账号最多同时保持 max_connections_per_account 个已完成TLS握手和登录的连接，
+    多封邮件依次通过同一连接发送。连接空闲过久、发送数量达到上限或被服务器断开时
+    会丢弃并透明地重新建立，调用方无需处理。
+    """
+
+    def __init__(self, hostname, port, use_tls=True, max_connections_per_account=2,
+                 idle_timeout=240, max_messages_per_connection=90, timeout=30):
+        """
+        Args:
+            hostname: SMTP服务器地址
+            port: SMTP端口
+            use_tls: 是否直接使用TLS连接（465端口）
+            max_connections_per_account: 每个发件账号的最大并发连接数
+            idle_timeout: 空闲超过该秒数的连接不再复用（服务器通常会主动断开）
+            max_messages_per_connection: 单个连接最多发送的邮件数，超过后重新连接
+            timeout: 连接和命令的超时时间（秒）
+        """
+        self.hostname = hostname
+        self.port = port
+        self.use_tls = use_tls
+        self.max_connections_per_account = max(1, int(max_connections_per_account))
+        self.idle_timeout = idle_timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self.timeout = timeout
+        self.idle = {}  # 用户名 -> 空闲连接列表
+        self.slots = {}  # 用户名 -> 限制并发连接数的信号量
+        self.stats = {"connects": 0, "logins": 0, "reconnects": 0, "messages": 0}
+
+    def _slot(self, username):
+        if username not in self.slots:
+            self.slots[username] = asyncio.Semaphore(self.max_connections_per_account)
+            self.idle[username] = []
+        return self.slots[username]
+
+    async def _connect(self, account):
+        """建立新连接并登录"""
+        import aiosmtplib
+
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            timeout=self.timeout
+        )
+        await smtp.connect()
+        self.stats["connects"] += 1
+        try:
+            await smtp.login(account['username'], account['password'])
+        except Exception:
+            await self._discard(smtp)
+            raise
+        self.stats["logins"] += 1
+        return PooledConnection(smtp)
+
+    async def _discard(self, smtp):
+        """关闭连接，忽略关闭过程中的错误"""
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _reusable(self, conn):
+        return (
+            conn.smtp.is_connected
+            and conn.messages_sent < self.max_messages_per_connection
+            and time.monotonic() - conn.last_used < self.idle_timeout
+        )
+
+    async def _acquire(self, account):
+        """取一个可复用的空闲连接，没有时新建"""
+        idle = self.idle[account['username']]
+        while idle:
+            conn = idle.pop()
+            if self._reusable(conn):
+                return conn
+            await self._discard(conn.smtp)
+        return await self._connect(account)
+
+    def _release(self, account, conn):
+        conn.last_used = time.monotonic()
+        self.idle[account['username']].append(conn)
+
+    async def send_message(self, account, msg, recipients=None):
+        """通过发件账号的连接发送邮件
+
+        复用的连接在发送时发现已被断开，会重新连接并重试一次。
+
+        Returns:
+            aiosmtplib.send_message 的返回值：(被拒收件人字典, 服务器响应)
+        """
+        # aiosmtplib 在第一次发送时才导入，不影响启动速度
+        import aiosmtplib
+
+        async with self._slot(account['username']):
+            conn = await self._acquire(account)
+            try:
+                try:
+                    response = await conn.smtp.send_message(msg, recipients=recipients)
+                except (aiosmtplib.SMTPServerDisconnected, ConnectionError):
+                    if conn.messages_sent == 0:
+                        raise
+                    # 复用的连接已被服务器关闭，透明重连后重试
+                    await self._discard(conn.smtp)
+                    self.stats["reconnects"] += 1
+                    conn = await self._connect(account)
+                    response = await conn.smtp.send_message(msg, recipients=recipients)
+            except Exception:
+                await self._discard(conn.smtp)
+                raise
+            conn.messages_sent += 1
+            self.stats["messages"] += 1
+            self._release(account, conn)
+            return response
+
+    async def close(self):
+        """关闭所有空闲连接"""
+        for username, idle in self.idle.items():
+            while idle:
+                await self._discard(idle.pop().smtp)
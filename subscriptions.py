@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import re
+
+
+# 注册表中订阅关键词/公众号之间允许的分隔符
+SUBSCRIPTION_SEPARATORS = re.compile(r"[,，、;；\s]+")
+
+
+def parse_subscription_field(value):
+    """把注册表中的订阅字段拆分成列表，空值返回空列表"""
+    if not isinstance(value, str):
+        return []
+    return [item for item in SUBSCRIPTION_SEPARATORS.split(value.strip()) if item]
+
+
+class SubscriptionIndex:
+    """收件人订阅的倒排索引
+
+    每个收件人可以在 config['email']['subscriptions'] 中订阅部分关键词和公众号，
+    未设置（或为空）时表示订阅全部关键词/全部公众号。索引按关键词 -> 收件人集合
+    组织，一次提醒只需合并命中关键词对应的集合，再按公众号过滤。
+    """
+
+    def __init__(self, recipients, subscriptions, keywords):
+        """
+        Args:
+            recipients: 全部收件人
+            subscriptions: 收件人 -> {"keywords": [...], "accounts": [...]}
+            keywords: 全局关键词，未设置订阅关键词的收件人订阅这些关键词
+        """
+        self.global_keywords = list(keywords)
+        self.keyword_recipients = {keyword: set() for keyword in self.global_keywords}
+        self.account_filters = {}
+
+        for recipient in dict.fromkeys(recipients):
+            subscription = subscriptions.get(recipient) or {}
+            subscribed_keywords = subscription.get('keywords') or self.global_keywords
+            for keyword in subscribed_keywords:
+                self.keyword_recipients.setdefault(keyword, set()).add(recipient)
+            subscribed_accounts = subscription.get('accounts')
+            if subscribed_accounts:
+                self.account_filters[recipient] = set(subscribed_accounts)
+
+    @property
+    def keywords(self):
+        """需要匹配的全部关键词：全局关键词加上收件人额外订阅的关键词"""
+        return list(self.keyword_recipients)
+
+    def recipients_for(self, keywords, account_name=None):
+        """返回订阅了任一命中关键词、且订阅了该公众号的收件人"""
+        matched = set()
+        for keyword in keywords:
+            matched |= self.keyword_recipients.get(keyword, set())
+        if account_name is not None:
+            matched = {
+                recipient for recipient in matched
+                if recipient not in self.account_filters or account_name in self.account_filters[recipient]
+            }
+        return sorted(matched)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import time
+
+from wechat_crawler import WeChatCrawler
+
+
+class FakeCrawler(WeChatCrawler):
+    """用内存中的文章列表代替公众号接口，记录每次请求的 begin/count"""
+
+    def __init__(self, articles):
+        super().__init__()
+        self.articles = articles  # 按发布时间倒序
+        self.requests = []
+
+    def fetch_article_page(self, account_name, count=1, begin=0):
+        self.requests.append((begin, count))
+        return self.articles[begin:begin + count]
+
+
+def make_articles(count, newest, spacing):
+    return [
+        {"title": f"文章{i}", "link": f"https://mp.weixin.qq.com/s?__biz=test&mid={i}&idx=1",
+         "create_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(newest - i * spacing)),
+         "timestamp": int(newest - i * spacing)}
+        for i in range(count)
+    ]
+
+
+def test_backlog_stops_at_freshness_window():
+    """游标之后积压了30篇（每小时一篇）：翻到时效窗口之外即停止，并视为完整"""
+    now = int(time.time())
+    articles = make_articles(30, now, 3600)
+    crawler = FakeCrawler(articles)
+    cursor = articles[-1]['timestamp'] - 1
+    new_articles, complete = crawler.get_new_articles("测试公众号", since=cursor, not_before=now - 8 * 3600)
+    assert complete, "paging stopped at the freshness window should be complete"
+    assert len(new_articles) == 9, len(new_articles)
+    assert len(crawler.requests) < crawler.MAX_INCREMENTAL_PAGES, crawler.requests
+
+    # 游标推进到取到的最新文章后，下一轮只需一次请求
+    crawler.requests = []
+    new_articles, complete = crawler.get_new_articles(
+        "测试公众号", since=max(a['timestamp'] for a in new_articles), not_before=now - 8 * 3600
+    )
+    assert complete and not new_articles
+    assert crawler.requests == [(0, 1)], crawler.requests
+
+
+def test_backlog_within_window_reaches_page_limit():
+    """时效窗口内积压超过翻页上限：放弃更早的文章并视为完整，下一轮不再重复翻页"""
+    now = int(time.time())
+    articles = make_articles(30, now, 60)
+    crawler = FakeCrawler(articles)
+    cursor = articles[-1]['timestamp'] - 1
+    new_articles, complete = crawler.get_new_articles("测试公众号", since=cursor, not_before=now - 8 * 3600)
+    assert complete
+    assert len(crawler.requests) == crawler.MAX_INCREMENTAL_PAGES, crawler.requests
+    assert [a['timestamp'] for a in new_articles] == [a['timestamp'] for a in articles[:len(new_articles)]]
+
+    crawler.requests = []
+    crawler.get_new_articles("测试公众号", since=new_articles[0]['timestamp'], not_before=now - 8 * 3600)
+    assert crawler.requests == [(0, 1)], crawler.requests
+
+
+def main():
+    """测试增量抓取在积压时的翻页行为"""
+    print("Starting incremental fetch test...")
+    test_backlog_stops_at_freshness_window()
+    test_backlog_within_window_reaches_page_limit()
+    print("Incremental fetch test completed")
+
+
+if __name__ == "__main__":
+    main()
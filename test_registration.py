@@ -15,6 +15,9 @@ def main():
     # 处理注册
     monitor.process_registrations()
     
+    # 欢迎邮件写入了待发队列，立即发送
+    monitor.drain_spool()
+    
     print("Registration test completed")
 
 if __name__ == "__main__":
@@ -8,13 +8,31 @@ import time
 from datetime import datetime
 import traceback
 
-import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class WeChatCrawler:
-    def __init__(self, cookie_path="cookies.json", fakeid_path="account_fakeids.json"):
-        """初始化微信爬虫"""
+    # 触发微信频率限制（ret=200013）后的退避时间（秒）
+    FREQ_CONTROL_BACKOFF = 300
+    # 公众号文章列表接口单页最多返回的文章数
+    MAX_PAGE_SIZE = 5
+    # 增量获取时最多翻页次数，防止游标过旧时无限翻页
+    MAX_INCREMENTAL_PAGES = 6
+    # Cookie文件中没有token时使用的默认值
+    DEFAULT_TOKEN = '1910835749'
+    
+    def __init__(self, cookie_path="cookies.json", fakeid_path="account_fakeids.json", rate_limiter=None, pool_size=4,
+                 log_hook=None):
+        """初始化微信爬虫
+
+        Args:
+            cookie_path: Cookie文件路径
+            fakeid_path: 公众号fakeid映射文件路径
+            rate_limiter: 可选的全局限流器（TokenBucket），所有线程共享，用于控制对公众号接口的请求频率
+            pool_size: 每个主机保持的长连接数，应不小于并发抓取的线程数
+            log_hook: 记录日志的函数 log_hook(message, level)，为 None 时输出到标准输出
+        """
         self.base_url = "https://mp.weixin.qq.com/cgi-bin/appmsg"
         self.user_agent_list = [
             'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.84 Safari/537.36',
@@ -26,18 +44,40 @@ class WeChatCrawler:
             'Mozilla/5.0 (Windows NT 6.1; rv:2.0.1) Gecko/20100101 Firefox/4.0.1',
             "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.75 Mobile Safari/537.36",
         ]
-        self.cookies = self.load_cookies(cookie_path)
-        self.token = self.cookies.get('token', '1910835749')  # 默认值，实际中需要从cookie中获取
+        self.cookie_path = cookie_path
+        self.fakeid_path = fakeid_path
+        self.log_hook = log_hook
+        self.pool_size = max(1, int(pool_size))
+        
+        # Cookie和设置了该Cookie的会话作为一个整体保存，重新加载时一次替换，
+        # 同一请求中的token和Cookie总是来自同一份文件
+        cookies = self.load_cookies(cookie_path)
+        self.auth = (cookies, self.create_session(cookies.get('cookie_string', '')))
+        # 公开的文章正文使用不带Cookie的会话，登录态只发给后台接口
+        self.content_session = self.create_session()
         
         # 加载公众号fakeid映射
         self.account_fakeids = self.load_account_fakeids(fakeid_path)
         
+        # 公众号接口的全局限流器
+        self.rate_limiter = rate_limiter
+        
+        # 每次请求完成后调用的回调（用于事件日志和指标），见 report_request
+        self.request_hook = None
+        
         # 数据目录
         self.data_dir = "data"
         
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
     
+    def log(self, message, level="INFO"):
+        """记录日志：交给 log_hook（如监控程序的日志写入器），没有时直接输出"""
+        if self.log_hook is None:
+            print(message)
+        else:
+            self.log_hook(message, level=level)
+    
     def load_cookies(self, cookie_path):
         """加载Cookie文件"""
         if os.path.exists(cookie_path):
@@ -45,10 +85,10 @@ class WeChatCrawler:
                 with open(cookie_path, 'r', encoding='utf-8') as f:
                     return json.load(f)
             except Exception as e:
-                print(f"Error loading cookies: {e}")
+                self.log(f"Error loading cookies: {e}", level="ERROR")
                 return self.get_default_cookies()
         else:
-            print(f"Cookie file {cookie_path} not found, using default cookies.")
+            self.log(f"Cookie file {cookie_path} not found, using default cookies.", level="WARNING")
             return self.get_default_cookies()
     
     def load_account_fakeids(self, fakeid_path):
@@ -59,17 +99,68 @@ class WeChatCrawler:
                     data = json.load(f)
                     return data.get("accounts", {})
             except Exception as e:
-                print(f"Error loading account fakeids: {e}")
+                self.log(f"Error loading account fakeids: {e}", level="ERROR")
                 return {}
         else:
-            print(f"Account fakeid file {fakeid_path} not found, using empty mapping.")
+            self.log(f"Account fakeid file {fakeid_path} not found, using empty mapping.", level="WARNING")
             return {}
     
+    @property
+    def cookies(self):
+        """当前的Cookie配置"""
+        return self.auth[0]
+    
+    @property
+    def session(self):
+        """带当前Cookie的后台接口会话"""
+        return self.auth[1]
+    
+    @property
+    def token(self):
+        """当前Cookie对应的token（实际中需要从cookie中获取）"""
+        return self.cookies.get('token', self.DEFAULT_TOKEN)
+    
+    def reload_cookies(self):
+        """重新加载Cookie文件
+        
+        为新的Cookie创建会话，与Cookie（含token）作为一个整体替换，请求中途替换也不会出现
+        新token配旧Cookie的情况；旧会话关闭，正在进行的请求完成后其连接随之关闭。
+        文件无法解析（例如正在写入）时保留原来的Cookie。
+        
+        Returns:
+            bool: 是否已替换
+        """
+        try:
+            with open(self.cookie_path, 'r', encoding='utf-8') as f:
+                cookies = json.load(f)
+        except Exception as e:
+            self.log(f"Error reloading cookies, keeping previous cookies: {e}", level="ERROR")
+            return False
+        old_session = self.session
+        self.auth = (cookies, self.create_session(cookies.get('cookie_string', '')))
+        old_session.close()
+        return True
+    
+    def reload_account_fakeids(self):
+        """重新加载公众号fakeid映射并整体替换，文件无法解析时保留原来的映射
+        
+        Returns:
+            bool: 是否已替换
+        """
+        try:
+            with open(self.fakeid_path, 'r', encoding='utf-8') as f:
+                account_fakeids = json.load(f).get("accounts", {})
+        except Exception as e:
+            self.log(f"Error reloading account fakeids, keeping previous mapping: {e}", level="ERROR")
+            return False
+        self.account_fakeids = account_fakeids
+        return True
+    
     def get_default_cookies(self):
         """获取默认Cookie（仅作示例，实际使用需要真实的登录态Cookie）"""
         return {
             "cookie_string": "",  # 实际使用时需要填入有效的Cookie字符串
-            "token": "1910835749"  # 实际使用时需要填入有效的token
+            "token": self.DEFAULT_TOKEN  # 实际使用时需要填入有效的token
         }
     
     def get_cookie_string(self):
@@ -82,89 +173,236 @@ class WeChatCrawler:
         fakeid = self.account_fakeids.get(account_name)
         
         if fakeid:
-            print(f"Found fakeid for {account_name}: {fakeid}")
+            self.log(f"Found fakeid for {account_name}: {fakeid}", level="DEBUG")
             return fakeid
         else:
-            print(f"Warning: No fakeid found for {account_name} in account_fakeids.json")
-            print(f"Please add {account_name}'s fakeid to account_fakeids.json")
+            self.log(f"Warning: No fakeid found for {account_name} in account_fakeids.json", level="WARNING")
+            self.log(f"Please add {account_name}'s fakeid to account_fakeids.json", level="WARNING")
             return None
     
     def get_headers(self):
-        """获取请求头"""
+        """获取请求头（Cookie已设置在会话上，这里只需随机User-Agent）"""
         return {
-            "Cookie": self.get_cookie_string(),
             "User-Agent": random.choice(self.user_agent_list)
         }
     
-    def get_articles(self, account_name, count=1):
+    def create_session(self, cookie_string=None):
+        """创建带连接池的会话
+        
+        同一主机的请求复用keep-alive连接，避免每次请求都重新进行TCP和TLS握手。
+        
+        Args:
+            cookie_string: 设置在会话上的Cookie，为空时不带Cookie
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,  # mp.weixin.qq.com 的 http 与 https 各一个连接池
+            pool_maxsize=self.pool_size,
+            pool_block=False
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if cookie_string:
+            session.headers["Cookie"] = cookie_string
+        return session
+    
+    def report_request(self, kind, **fields):
+        """把一次请求的结果交给 request_hook
+        
+        Args:
+            kind: 'list'（文章列表）或 'content'（文章正文）
+            fields: account, status, bytes, duration（秒）等，列表请求另有 begin, count, ret, articles
+        """
+        if self.request_hook is None:
+            return
+        try:
+            self.request_hook(kind, **fields)
+        except Exception as e:
+            self.log(f"Error in request hook: {e}", level="ERROR")
+    
+    def get_pool_stats(self):
+        """获取连接池统计信息
+        
+        Returns:
+            dict: 以 scheme://host:port 为键，包含已建立连接数、请求数和空闲连接数（后台接口和文章正文两个会话合计）
+        """
+        stats = {}
+        adapters = set(self.session.adapters.values()) | set(self.content_session.adapters.values())
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                entry = stats.setdefault(f"{pool.scheme}://{pool.host}:{pool.port}", {
+                    "connections_opened": 0, "requests": 0, "idle_connections": 0
+                })
+                entry["connections_opened"] += pool.num_connections
+                entry["requests"] += pool.num_requests
+                # 队列中的 None 是尚未建立连接的占位符
+                entry["idle_connections"] += sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0
+        return stats
+    
+    def close(self):
+        """关闭会话，释放所有连接"""
+        self.session.close()
+        self.content_session.close()
+    
+    def get_articles(self, account_name, count=1, begin=0):
         """获取公众号最新文章
         
         Args:
             account_name: 公众号名称
             count: 获取的文章数量，默认为1（最新一篇）
+            begin: 从第几篇开始获取（按发布时间倒序），默认为0
             
         Returns:
-            list: 文章列表，每篇文章包含title, link, create_time
+            list: 文章列表，每篇文章包含title, link, create_time, timestamp
         """
-        print(f"Getting latest {count} article(s) for {account_name}...")
+        self.log(f"Getting latest {count} article(s) for {account_name}...", level="DEBUG")
+        return self.fetch_article_page(account_name, count=count, begin=begin) or []
+    
+    def get_new_articles(self, account_name, since=None, not_before=None):
+        """增量获取公众号在 since 之后发布的文章
+        
+        先只请求最新一篇，若它比游标更新，则逐页扩大 begin/count 继续向后翻，
+        直到遇到不晚于游标的文章或到达列表末尾。没有新文章时只需一次 count=1 的请求，
+        两轮之间连续发布多次推送时也不会漏掉。
+        
+        游标很旧（例如停机多日）时，翻到发布时间早于 not_before 的文章即停止：
+        超过时效窗口的文章不会再发送提醒，不必取回。仍然翻满 MAX_INCREMENTAL_PAGES 页时
+        放弃更早的文章并视为完整，使游标前移，避免每轮都重复请求同样的几页。
+        
+        Args:
+            account_name: 公众号名称
+            since: 上次处理到的发布时间戳（秒），为 None 时只取第一页
+            not_before: 时效窗口的起点（时间戳），早于它的文章不再获取
+            
+        Returns:
+            tuple: (文章列表, 是否完整)。翻页中途请求失败时不完整，调用方此时不应推进游标
+        """
+        if since is None:
+            self.log(f"No cursor for {account_name}, getting first {self.MAX_PAGE_SIZE} article(s)...", level="DEBUG")
+            articles = self.fetch_article_page(account_name, count=self.MAX_PAGE_SIZE)
+            return (articles or []), articles is not None
+        
+        self.log(f"Getting articles for {account_name} published after {since}...", level="DEBUG")
+        new_articles = []
+        begin, count = 0, 1
+        for _ in range(self.MAX_INCREMENTAL_PAGES):
+            page = self.fetch_article_page(account_name, count=count, begin=begin)
+            if page is None:
+                return new_articles, False
+            
+            for article in page:
+                if article['timestamp'] <= since:
+                    return new_articles, True
+                if not_before is not None and article['timestamp'] < not_before:
+                    self.log(f"Reached articles older than the freshness window for {account_name}, "
+                             f"{len(new_articles)} new article(s)")
+                    return new_articles, True
+                new_articles.append(article)
+            
+            # 列表已到末尾
+            if len(page) < count:
+                return new_articles, True
+            
+            begin += count
+            count = min(count * 2, self.MAX_PAGE_SIZE)
+        
+        self.log(f"Reached page limit while catching up {account_name}, skipping articles older than "
+                 f"the {len(new_articles)} fetched", level="WARNING")
+        return new_articles, True
+    
+    def fetch_article_page(self, account_name, count=1, begin=0):
+        """请求一页文章列表
         
+        Returns:
+            list: 文章列表；请求失败时返回 None，以便与"没有文章"区分
+        """
         # 获取公众号的fakeid
         fakeid = self.get_account_fakeid(account_name)
         if not fakeid:
-            print(f"Failed to get fakeid for {account_name}")
-            return []
+            self.log(f"Failed to get fakeid for {account_name}", level="ERROR")
+            return None
         
-        # 确保count是整数
+        # 确保count和begin是整数
         try:
             count = int(count)
         except (TypeError, ValueError):
-            print(f"Invalid count value: {count}, using default value 1")
+            self.log(f"Invalid count value: {count}, using default value 1", level="WARNING")
             count = 1
+        try:
+            begin = max(0, int(begin))
+        except (TypeError, ValueError):
+            self.log(f"Invalid begin value: {begin}, using default value 0", level="WARNING")
+            begin = 0
+        
+        # token和会话（Cookie）取自同一份快照，重新加载时不会错配
+        cookies, session = self.auth
+        headers = self.get_headers()
         
         # 构造请求参数
         params = {
-            "token": self.token,
+            "token": cookies.get('token', self.DEFAULT_TOKEN),
             "lang": "zh_CN",
             "f": "json",
             "ajax": "1",
             "action": "list_ex",
-            "begin": "0",
+            "begin": str(begin),
             "count": str(count),  # 转换为字符串
             "query": "",
             "fakeid": fakeid,
             "type": "9",
         }
-        
         # 打印请求参数（不包含敏感信息）
-        print(f"Request parameters: {params}")
+        self.log(f"Request parameters: {params}", level="DEBUG")
         
+        # 等待限流器发放令牌；限流器已关闭（程序正在停止）时不再发请求
+        if self.rate_limiter and not self.rate_limiter.acquire():
+            self.log(f"Rate limiter closed, skipping request for {account_name}", level="DEBUG")
+            return None
+        
+        report = {"account": account_name, "begin": begin, "count": count,
+                  "status": None, "bytes": 0, "ret": None, "articles": None}
+        # 耗时不含等待令牌的时间
+        started = time.monotonic()
         try:
-            # 发送请求
-            response = requests.get(
+            response = session.get(
                 self.base_url, 
-                headers=self.get_headers(), 
+                headers=headers, 
                 params=params,
                 timeout=10
             )
+            report["status"] = response.status_code
+            report["bytes"] = len(response.content)
             
             # 检查响应状态
             if response.status_code != 200:
-                print(f"Failed to get articles, status code: {response.status_code}")
-                print(f"Response content: {response.text}")
-                return []
+                self.log(f"Failed to get articles, status code: {response.status_code}", level="ERROR")
+                self.log(f"Response content: {response.text}", level="DEBUG")
+                return None
             
             # 解析响应数据
             content_json = response.json()
-            print(f"API Response status: {content_json.get('base_resp', {}).get('err_msg', 'unknown')}")
+            report["ret"] = content_json.get('base_resp', {}).get('ret')
+            self.log(f"API Response status: {content_json.get('base_resp', {}).get('err_msg', 'unknown')}", level="DEBUG")
             
             # 检查错误码
             if content_json.get('base_resp', {}).get('ret') == 200002:
-                print("Token may be expired or invalid. Please update your cookies.")
-                return []
+                self.log("Token may be expired or invalid. Please update your cookies.", level="ERROR")
+                return None
+            
+            # 触发频率限制时暂停所有线程的请求
+            if content_json.get('base_resp', {}).get('ret') == 200013:
+                self.log(f"Frequency control triggered for {account_name}, backing off for {self.FREQ_CONTROL_BACKOFF} seconds", level="WARNING")
+                if self.rate_limiter:
+                    self.rate_limiter.pause(self.FREQ_CONTROL_BACKOFF)
+                return None
             
             if 'app_msg_list' not in content_json:
-                print(f"No articles found for {account_name}, response: {content_json}")
-                return []
+                self.log(f"No articles found for {account_name}, response: {content_json}", level="WARNING")
+                return None
             
             # 提取文章信息
             articles = []
@@ -176,19 +414,23 @@ class WeChatCrawler:
                 articles.append({
                     "title": item["title"],
                     "link": item["link"],
-                    "create_time": create_time
+                    "create_time": create_time,
+                    "timestamp": item["create_time"]
                 })
                 
                 # 打印检查点
-                print(f"Found article: {item['title']} - {create_time}")
-                print(f"URL: {item['link']}")
+                self.log(f"Found article: {item['title']} - {create_time}", level="DEBUG")
+                self.log(f"URL: {item['link']}", level="DEBUG")
             
+            report["articles"] = len(articles)
             return articles
             
         except Exception as e:
-            print(f"Error getting articles for {account_name}: {e}")
-            print(f"Full error details: {traceback.format_exc()}")
-            return []
+            self.log(f"Error getting articles for {account_name}: {e}", level="ERROR")
+            self.log(f"Full error details: {traceback.format_exc()}", level="ERROR")
+            return None
+        finally:
+            self.report_request('list', duration=time.monotonic() - started, **report)
     
     def save_articles_to_csv(self, account_name, articles):
         """保存文章到CSV文件"""
@@ -197,31 +439,44 @@ class WeChatCrawler:
         
         file_path = os.path.join(self.data_dir, f"{account_name}_articles.csv")
         
+        # pandas 只用于导出，不在监控程序启动时导入
+        import pandas as pd
+        
         # 准备DataFrame
         df = pd.DataFrame(articles)
         
         # 保存到CSV
         df.to_csv(file_path, index=False, encoding='utf-8')
-        print(f"Saved {len(articles)} articles to {file_path}")
+        self.log(f"Saved {len(articles)} articles to {file_path}")
     
-    def get_article_content(self, url):
-        """获取文章内容"""
+    def get_article_content(self, url, account_name=None):
+        """获取文章内容
+        
+        Args:
+            url: 文章链接
+            account_name: 文章所属公众号，只用于 request_hook
+        """
+        report = {"account": account_name, "url": url, "status": None, "bytes": 0}
+        started = time.monotonic()
         try:
-            headers = {"User-Agent": random.choice(self.user_agent_list)}
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.content_session.get(url, headers=self.get_headers(), timeout=10)
+            report["status"] = response.status_code
+            report["bytes"] = len(response.content)
             
             if response.status_code != 200:
-                print(f"Failed to get article content, status code: {response.status_code}")
+                self.log(f"Failed to get article content, status code: {response.status_code}", level="ERROR")
                 return None
             
             # 打印检查点
-            print(f"Successfully fetched article content, content length: {len(response.content)} bytes")
+            self.log(f"Successfully fetched article content, content length: {len(response.content)} bytes", level="DEBUG")
             
             # 返回HTML内容
             return response.content.decode('utf-8', errors='ignore')
         except Exception as e:
-            print(f"Error getting article content: {e}")
+            self.log(f"Error getting article content: {e}", level="ERROR")
             return None
+        finally:
+            self.report_request('content', duration=time.monotonic() - started, **report)
 
 
 # 使用示例
@@ -1,51 +1,206 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
+import argparse
 import json
 import os
-import random
-import re
-import smtplib
+import signal
 import time
-import base64
 import asyncio
-import aiosmtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
 from email.utils import formataddr
 import traceback
-import pandas as pd
-import requests
-import schedule
-from lxml import etree
 
+from article_store import SeenArticleStore, canonical_article_key
+from event_log import EventLog
+from file_watcher import FileWatcher
+from keyword_matcher import KeywordMatcher
+from log_writer import LOG_LEVELS, AsyncLogWriter
+from metrics import MetricsServer, MonitorMetrics
+from mail_spool import DeliveryLedger, MailSpool
+from mail_templates import (
+    IMAGE_CID, InlineImageCache, build_message, html_part,
+    render_alert_html, render_digest_html, render_welcome_html
+)
+from poll_scheduler import AdaptiveScheduler, PublishHistory
+from rate_limiter import TokenBucket
+from sender_pool import SenderPool, is_quota_error
+from smtp_pool import SMTPConnectionPool
+from registrations import RecipientStore, RegistrationReader
+from subscriptions import SubscriptionIndex, parse_subscription_field
 from wechat_crawler import WeChatCrawler
 
 
 class WeChatMonitor:
-    def __init__(self, config_path="config.json"):
-        """初始化微信监控器"""
+    # 投递任务空闲时检查队列的最长间隔（秒）
+    DELIVERY_POLL_SECONDS = 30
+    # 汇总模式下一次合并发送的最多文章数
+    DIGEST_BATCH_LIMIT = 200
+    # 一轮抓取出错后重试前的等待时间（秒）
+    ERROR_RETRY_SECONDS = 120
+    # 停止时等待正在发送的邮件完成的最长时间（秒）
+    SHUTDOWN_GRACE_SECONDS = 30
+    
+    def __init__(self, config_path="config.json", console=None):
+        """初始化微信监控器
+        
+        Args:
+            config_path: 配置文件路径
+            console: 是否把日志同时输出到控制台，None 时按 logging.console 配置
+        """
+        self.config_path = config_path
         self.config = self.load_config(config_path)
+        self.rebuild_subscriptions()
         self.data_dir = "data"
         self.log_dir = "logs"
         self.ensure_dirs_exist()
         
+        # 日志由后台线程批量写入，记录日志不阻塞抓取和发送
+        logging_config = self.config.get('logging', {})
+        self.log_level = LOG_LEVELS.get(str(logging_config.get('level', 'INFO')).upper(), LOG_LEVELS['INFO'])
+        self.log_writer = AsyncLogWriter(
+            self.log_dir,
+            max_bytes=logging_config.get('max_bytes', 10 * 1024 * 1024),
+            flush_interval=logging_config.get('flush_interval_seconds', 1.0),
+            compress=logging_config.get('compress', True),
+            echo=logging_config.get('console', True) if console is None else console
+        )
+        
+        # 可选的结构化事件日志（logs/events/<日期>.jsonl），供分析工具使用
+        events_writer = None
+        if logging_config.get('events', False):
+            events_dir = os.path.join(self.log_dir, "events")
+            os.makedirs(events_dir, exist_ok=True)
+            events_writer = AsyncLogWriter(
+                events_dir,
+                max_bytes=logging_config.get('max_bytes', 10 * 1024 * 1024),
+                flush_interval=logging_config.get('flush_interval_seconds', 1.0),
+                compress=logging_config.get('compress', True),
+                echo=False,
+                extension='.jsonl'
+            )
+        self.events = EventLog(events_writer)
+        
+        # 可选的指标接口：计数器和延迟直方图由上面的结构化事件驱动更新
+        self.metrics_config = self.config.get('metrics', {})
+        self.metrics = None
+        self.metrics_server = None
+        if self.metrics_config.get('enabled', False):
+            self.metrics = MonitorMetrics()
+            self.events.add_listener(self.metrics.observe)
+        
+        # 并发抓取配置：所有线程共享一个令牌桶，按接口频率预算发请求
+        polling_config = self.config.get('polling', {})
+        self.max_workers = max(1, int(polling_config.get('max_workers', 4)))
+        self.rate_limiter = TokenBucket.per_minute(
+            polling_config.get('requests_per_minute', 20),
+            burst=polling_config.get('burst', 5)
+        )
+        # 爬虫基于 requests（阻塞I/O），各公众号在该线程池中抓取，由事件循环调度
+        self.poll_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="poll")
+        
         # 初始化微信爬虫
-        self.crawler = WeChatCrawler()
+        self.crawler = WeChatCrawler(rate_limiter=self.rate_limiter, pool_size=self.max_workers, log_hook=self.logger)
+        self.crawler.request_hook = self.on_crawler_request
         
         # 初始化已经检查过的文章URL缓存
+        # 文章时效窗口与已检查记录的保留期限（保留期限不短于时效窗口）
+        retention_config = self.config.get('retention', {})
+        self.max_article_age_hours = retention_config.get('max_article_age_hours', 8)
+        self.retention_hours = max(self.max_article_age_hours, retention_config.get('ttl_hours', 72))
+        self.compaction_interval_hours = retention_config.get('compaction_interval_hours', 6)
+        
         self.checked_articles_file = os.path.join(self.data_dir, "checked_articles.json")
-        self.checked_articles = self.load_checked_articles()
+        self.checked_articles = SeenArticleStore(
+            os.path.join(self.data_dir, "seen_articles.db"),
+            legacy_json_path=self.checked_articles_file
+        )
+        
+        # 各公众号的增量抓取游标
+        self.account_cursors_file = os.path.join(self.data_dir, "account_cursors.json")
+        self.account_cursors = self.load_account_cursors()
+        self.account_cursors_lock = threading.Lock()
+        
+        # 历史推送时间与自适应调度器
+        self.publish_history = PublishHistory(
+            os.path.join(self.data_dir, "publish_history.json"),
+            log_dir=self.log_dir
+        )
+        self.scheduler = self.create_scheduler()
+        
+        # 注册表增量读取：只解析新追加的行，文件没变化时只做一次 stat
+        self.recipient_store = RecipientStore(self.config['email']['recipients'])
+        self.registration_reader = RegistrationReader(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "reg.csv"),
+            os.path.join(self.data_dir, "registration_state.json")
+        )
+        self.registration_poll_seconds = self.config.get('registration', {}).get('poll_seconds', 60)
+        
+        # 配置、Cookie和fakeid文件修改后自动重新加载，无需重启
+        self.config_watcher = FileWatcher([config_path, self.crawler.cookie_path, self.crawler.fakeid_path])
+        self.reload_poll_seconds = self.config.get('reload', {}).get('poll_seconds', 10)
+        # 热加载和注册表处理在不同的工作线程中运行，都会读写 self.config 和配置文件，用同一把锁串行
+        self.config_lock = threading.Lock()
         
         # 创建事件循环
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         
+        # 邮件内联图片和欢迎邮件正文缓存
+        self.inline_image = InlineImageCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "img.jpg"))
+        self.welcome_body_parts = {}
+        
+        email_config = self.config['email']
+        
+        # 汇总模式：一轮（或一个窗口）内的命中文章合并成一封邮件
+        self.digest_config = email_config.get('digest', {})
+        
+        # 在多个发件账号之间均衡发送量，并跟踪每个账号的配额
+        self.sender_pool = SenderPool(
+            email_config['accounts'],
+            daily_limit=email_config.get('daily_limit_per_account', 500),
+            per_minute_limit=email_config.get('per_minute_limit_per_account', 20),
+            state_path=os.path.join(self.data_dir, "sender_usage.json")
+        )
+        
+        # 按发件账号复用的SMTP连接池
+        self.smtp_pool = SMTPConnectionPool(
+            email_config['smtp_server'],
+            email_config['smtp_port'],
+            use_tls=True,
+            max_connections_per_account=email_config.get('max_connections_per_account', 2)
+        )
+        
+        # 持久化的待发邮件队列，由后台投递任务发送，抓取不等待SMTP
+        spool_config = email_config.get('spool', {})
+        self.delivery_concurrency = max(1, int(spool_config.get('max_concurrency', 4)))
+        self.mail_spool = MailSpool(
+            os.path.join(self.data_dir, "mail_spool.db"),
+            max_attempts=spool_config.get('max_attempts', 8),
+            base_delay=spool_config.get('base_delay_seconds', 30),
+            max_delay=spool_config.get('max_delay_seconds', 3600)
+        )
+        # 发送账本：记录每个收件人已收到的邮件，重试和重启后不重复发送
+        self.delivery_ledger = DeliveryLedger(os.path.join(self.data_dir, "mail_spool.db"))
+        self.delivery_wakeup = None
+        
+        # 运行时（run）中的停止信号和自适应调度的唤醒信号
+        self.stop_event = None
+        self.poll_wakeup = None
+        
+        # 由守护进程（daemon.py）监控时定期写入的心跳文件，同时记录重启后恢复所需的调度状态
+        self.heartbeat_path = None
+        self.heartbeat_seconds = self.config.get('supervisor', {}).get('heartbeat_seconds', 10)
+        self.started_at = time.time()
+        self.ready = False
+        self.last_round_at = None
+        
         self.logger("WeChatMonitor initialized")
         self.logger(f"Monitoring accounts: {', '.join(self.config['accounts'])}")
         self.logger(f"Watching for keywords: {', '.join(self.config['keywords'])}")
         self.logger(f"Email accounts configured: {len(self.config['email']['accounts'])}")
+        self.logger(f"Polling with {self.max_workers} workers at {polling_config.get('requests_per_minute', 20)} requests/minute")
 
     def load_config(self, config_path):
         """加载配置文件"""
@@ -56,47 +211,205 @@ class WeChatMonitor:
             print(f"Error loading config: {e}")
             exit(1)
     
+    def rebuild_subscriptions(self):
+        """根据收件人订阅重建倒排索引和关键词匹配器
+        
+        两者都先构建好再替换。抓取线程先读匹配器、后读订阅索引，
+        因此先替换订阅索引：用新匹配器命中的关键词一定能在索引中找到收件人。
+        """
+        email_config = self.config['email']
+        subscriptions = SubscriptionIndex(
+            email_config['recipients'],
+            email_config.get('subscriptions', {}),
+            self.config['keywords']
+        )
+        keyword_matcher = KeywordMatcher(subscriptions.keywords)
+        self.subscriptions = subscriptions
+        self.keyword_matcher = keyword_matcher
+    
+    def reload_config(self):
+        """重新加载配置文件并替换关键词、订阅、收件人和监控的公众号
+        
+        文件无法解析或缺少必要字段时保留原配置。线程数、SMTP服务器等其余设置需要重启才生效。
+        
+        Returns:
+            bool: 是否已重新加载
+        """
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            accounts = list(config['accounts'])
+            keywords = list(config['keywords'])
+            recipients = config['email']['recipients']
+        except Exception as e:
+            self.logger(f"Error reloading config, keeping previous config: {e}", level="ERROR")
+            return False
+        
+        old_config = self.config
+        self.config = config
+        self.rebuild_subscriptions()
+        self.recipient_store = RecipientStore(recipients)
+        self.digest_config = config['email'].get('digest', {})
+        if self.scheduler:
+            self.scheduler.set_accounts(accounts, polls_per_day=self.polls_per_day())
+            # 新加入的公众号立即到期，唤醒抓取任务重新计算等待时间
+            self.notify_poller()
+        
+        added = [a for a in accounts if a not in old_config['accounts']]
+        removed = [a for a in old_config['accounts'] if a not in accounts]
+        self.logger(f"Reloaded config: {len(accounts)} accounts (+{len(added)} -{len(removed)}), "
+                    f"{len(keywords)} keywords, {len(recipients)} recipients")
+        if keywords != old_config['keywords']:
+            self.logger(f"Watching for keywords: {', '.join(keywords)}")
+        return True
+    
+    def reload_changed_files(self):
+        """检查配置、Cookie和fakeid文件，有修改的重新加载"""
+        with self.config_lock:
+            for path in self.config_watcher.changed():
+                if path == self.config_path:
+                    self.reload_config()
+                elif path == self.crawler.cookie_path:
+                    if self.crawler.reload_cookies():
+                        self.logger(f"Reloaded cookies from {path}")
+                elif path == self.crawler.fakeid_path:
+                    if self.crawler.reload_account_fakeids():
+                        self.logger(f"Reloaded {len(self.crawler.account_fakeids)} account fakeids from {path}")
+    
+    def polls_per_day(self):
+        """自适应调度的总轮询预算：公众号数 × 每天按 interval_hours 轮询的次数"""
+        return len(self.config['accounts']) * 24 / self.config.get('interval_hours', 1)
+    
+    def create_scheduler(self):
+        """根据配置创建自适应调度器，未启用时返回 None
+        
+        总轮询预算与固定间隔模式相同：公众号数 × 每天按 interval_hours 轮询的次数。
+        """
+        schedule_config = self.config.get('schedule', {})
+        if not schedule_config.get('adaptive', False):
+            return None
+        return AdaptiveScheduler(
+            self.config['accounts'],
+            self.publish_history,
+            self.polls_per_day(),
+            min_interval_minutes=schedule_config.get('min_interval_minutes', 10),
+            max_interval_hours=schedule_config.get('max_interval_hours', 12)
+        )
+    
     def ensure_dirs_exist(self):
         """确保所需目录存在"""
         for directory in [self.data_dir, self.log_dir]:
             if not os.path.exists(directory):
                 os.makedirs(directory)
     
-    def load_checked_articles(self):
-        """加载已检查过的文章列表"""
-        if os.path.exists(self.checked_articles_file):
+    def load_account_cursors(self):
+        """加载各公众号的游标（已处理到的最新发布时间戳）"""
+        if os.path.exists(self.account_cursors_file):
             try:
-                with open(self.checked_articles_file, 'r', encoding='utf-8') as f:
+                with open(self.account_cursors_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
             except Exception as e:
-                self.logger(f"Error loading checked articles: {e}")
+                self.logger(f"Error loading account cursors: {e}", level="ERROR")
                 return {}
         return {}
     
-    def save_checked_articles(self):
-        """保存已检查过的文章列表"""
+    def save_account_cursors(self):
+        """保存各公众号的游标"""
         try:
-            with open(self.checked_articles_file, 'w', encoding='utf-8') as f:
-                json.dump(self.checked_articles, f, ensure_ascii=False, indent=2)
+            with self.account_cursors_lock:
+                snapshot = dict(self.account_cursors)
+            with open(self.account_cursors_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
         except Exception as e:
-            self.logger(f"Error saving checked articles: {e}")
+            self.logger(f"Error saving account cursors: {e}", level="ERROR")
     
-    def logger(self, message):
-        """记录日志"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}"
-        print(log_message)
+    def get_account_cursor(self, account_name):
+        """获取公众号的游标，没有时返回 None"""
+        with self.account_cursors_lock:
+            cursor = self.account_cursors.get(account_name)
+        return cursor['create_time'] if cursor else None
+    
+    def advance_account_cursor(self, account_name, articles):
+        """根据本轮处理结果推进游标
         
-        log_file = os.path.join(self.log_dir, f"{datetime.now().strftime('%Y-%m-%d')}.log")
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(log_message + "\n")
+        若有文章因获取内容失败而未被标记为已检查，游标停在其发布时间之前，
+        下一轮会重新取到它；已检查的文章则由 checked_articles 去重。
+        """
+        if not articles:
+            return
+        
+        pending = [
+            a['timestamp'] for a in articles
+            if canonical_article_key(a['link']) not in self.checked_articles
+        ]
+        new_cursor = min(pending) - 1 if pending else max(a['timestamp'] for a in articles)
+        
+        with self.account_cursors_lock:
+            cursor = self.account_cursors.get(account_name)
+            if cursor is None or new_cursor > cursor['create_time']:
+                self.account_cursors[account_name] = {
+                    "create_time": new_cursor,
+                    "update_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+    
+    def logger(self, message, level="INFO"):
+        """记录日志（放入写入队列后立即返回）
+        
+        Args:
+            level: 日志级别（DEBUG/INFO/WARNING/ERROR），低于配置的 logging.level 时不记录
+        """
+        if LOG_LEVELS.get(level, LOG_LEVELS['INFO']) < self.log_level:
+            return
+        now = datetime.now()
+        self.log_writer.write(now.strftime('%Y-%m-%d'), f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] {message}")
+    
+    def on_crawler_request(self, kind, duration, **fields):
+        """爬虫每次请求完成后的回调（在抓取线程中调用），记录请求事件"""
+        duration_ms = round(duration * 1000, 1)
+        if kind == 'list':
+            self.events.emit('list_fetched', duration_ms=duration_ms, **fields)
+        elif kind == 'content':
+            url = fields.pop('url')
+            self.events.emit('content_fetched', article_key=canonical_article_key(url), duration_ms=duration_ms, **fields)
+    
+    def start_metrics_server(self):
+        """启用指标时在后台线程中提供 /metrics 接口"""
+        if self.metrics is None or self.metrics_server is not None:
+            return
+        
+        def collect():
+            self.metrics.spool_items.clear()
+            for status, count in self.mail_spool.counts().items():
+                self.metrics.spool_items.set(count, status=status)
+            for sender, count in self.sender_pool.usage().items():
+                self.metrics.sender_usage.set(count, sender=sender)
+        
+        self.metrics.registry.on_collect(collect)
+        server = MetricsServer(
+            self.metrics.registry,
+            host=self.metrics_config.get('host', '127.0.0.1'),
+            port=self.metrics_config.get('port', 9108)
+        )
+        try:
+            server.start()
+        except OSError as e:
+            self.logger(f"Failed to start metrics server: {e}", level="ERROR")
+            return
+        self.metrics_server = server
+        self.logger(f"Metrics available at http://{server.host}:{server.port}/metrics")
     
     def fetch_account_articles(self, account_name):
-        """获取公众号最新文章列表"""
+        """增量获取公众号自上次游标以来的新文章
+        
+        Returns:
+            tuple: (文章列表, 是否完整)，不完整时不推进游标
+        """
+        cursor = self.get_account_cursor(account_name)
         self.logger(f"Fetching latest article for: {account_name}")
         
-        # 使用微信爬虫获取最新一篇文章
-        articles = self.crawler.get_articles(account_name, count=1)
+        # 只获取游标之后、时效窗口之内发布的文章
+        not_before = time.time() - self.max_article_age_hours * 3600
+        articles, complete = self.crawler.get_new_articles(account_name, since=cursor, not_before=not_before)
         
         if articles:
             self.logger(f"Found {len(articles)} article for {account_name}")
@@ -108,32 +421,36 @@ class WeChatMonitor:
         else:
             self.logger(f"No articles found for {account_name}")
         
-        return articles
+        return articles, complete
     
-    def fetch_article_content(self, article_url):
+    def fetch_article_content(self, article_url, account_name=None):
         """获取文章内容"""
         try:
             # 使用微信爬虫获取文章内容
-            html_content = self.crawler.get_article_content(article_url)
+            html_content = self.crawler.get_article_content(article_url, account_name=account_name)
             
             if not html_content:
-                self.logger(f"Failed to fetch content for {article_url}")
+                self.logger(f"Failed to fetch content for {article_url}", level="ERROR")
                 return None
             
-            # 使用lxml解析文章内容
+            # 使用lxml解析文章内容（第一次解析时才导入）
+            from lxml import etree
+            started = time.monotonic()
             html = etree.HTML(html_content)
             title = ''.join(html.xpath("//*[@id=\"activity-name\"]/text()")).strip()
             author = ''.join(html.xpath("//*[@id=\"js_name\"]/text()")).strip()
             content = '\n'.join(html.xpath("//*[@id=\"js_content\"]//text()")).strip()
+            self.events.emit('content_parsed', account=account_name, article_key=canonical_article_key(article_url),
+                             chars=len(content), duration_ms=round((time.monotonic() - started) * 1000, 3))
             
             # 打印内容检查点
-            self.logger(f"Parsed article title: {title}")
-            self.logger(f"Parsed article author: {author}")
-            self.logger(f"Content length: {len(content)} characters")
+            self.logger(f"Parsed article title: {title}", level="DEBUG")
+            self.logger(f"Parsed article author: {author}", level="DEBUG")
+            self.logger(f"Content length: {len(content)} characters", level="DEBUG")
             
             # 打印内容摘要
             content_preview = content[:200] + "..." if len(content) > 200 else content
-            self.logger(f"Content preview: {content_preview}")
+            self.logger(f"Content preview: {content_preview}", level="DEBUG")
             
             return {
                 "title": title or "未获取到标题",
@@ -142,432 +459,996 @@ class WeChatMonitor:
                 "url": article_url
             }
         except Exception as e:
-            self.logger(f"Error fetching article content: {e}")
+            self.logger(f"Error fetching article content: {e}", level="ERROR")
             return None
     
     def check_keywords(self, text):
-        """检查文本中是否包含关键词"""
+        """检查文本中是否包含关键词（单次扫描匹配所有关键词）"""
         if not text:
             return []
+        return self.keyword_matcher.find(text)
+    
+    async def acquire_sender(self, count, tried):
+        """从发件账号池中取发送量最少的可用账号，短暂超出每分钟上限时等待
         
-        found_keywords = []
-        for keyword in self.config['keywords']:
-            if keyword in text:
-                found_keywords.append(keyword)
+        Returns:
+            dict: 发件账号；所有未尝试过的账号都已达到上限或被限流时返回 None
+        """
+        while True:
+            account = self.sender_pool.acquire(count, exclude=tried)
+            if account:
+                return account
+            wait = self.sender_pool.wait_time(count, exclude=tried)
+            if wait is None:
+                return None
+            await asyncio.sleep(wait)
+    
+    def handle_send_failure(self, account, count, error):
+        """撤销预占的发送量；触发配额或频率限制的账号暂时移出轮换，临时错误的账号短暂退避"""
+        self.sender_pool.release(account['username'], count)
+        paused = self.sender_pool.record_failure(account['username'], error)
+        if paused is None:
+            return
+        if is_quota_error(error):
+            self.logger(f"Sender {account['username']} hit its sending limit, removed from rotation "
+                        f"for {paused} seconds", level="WARNING")
+        else:
+            self.logger(f"Sender {account['username']} returned a temporary error, backing off "
+                        f"for {paused} seconds", level="WARNING")
+    
+    def record_smtp_send(self, account, recipients, ok, started):
+        """记录一次SMTP发送的耗时（含等待连接和登录），用于按发件账号统计"""
+        self.events.emit('smtp_sent', sender=account['username'], recipients=recipients, ok=ok,
+                         duration_ms=round((time.monotonic() - started) * 1000, 1))
+    
+    def record_delivered(self, ledger, recipients):
+        """服务器接受后立即记入发送账本，投递中途被取消或进程退出时已收到的人不会重发
         
-        return found_keywords
+        Args:
+            ledger: 这封邮件对应的 (文章键, 邮件类型) 列表，汇总邮件对应多篇文章
+            recipients: 被接受的收件人
+        """
+        for article_key, kind in ledger or ():
+            self.delivery_ledger.record(article_key, kind, recipients)
     
-    async def send_email_async(self, msg, recipient):
-        """异步发送邮件，含失败自动切换备用邮箱机制"""
-        email_config = self.config['email']
+    async def send_email_async(self, msg, recipient, ledger=None):
+        """异步发送邮件，在发件账号之间均衡负载，失败时自动切换其他账号
+        
+        Args:
+            ledger: 发送成功后记入发送账本的 (文章键, 邮件类型) 列表
+        """
+        tried = set()
         
-        # 尝试每个配置的邮箱账号
-        for i, account in enumerate(email_config['accounts']):
+        while True:
+            account = await self.acquire_sender(1, tried)
+            if account is None:
+                self.logger(f"All email accounts failed or exhausted when sending to {recipient}", level="ERROR")
+                return False
+            tried.add(account['username'])
+            started = time.monotonic()
             try:
-                self.logger(f"Trying to send email to {recipient} using account {account['username']} (attempt {i+1}/{len(email_config['accounts'])})")
+                self.logger(f"Trying to send email to {recipient} using account {account['username']} (attempt {len(tried)}/{len(self.sender_pool.accounts)})", level="DEBUG")
                 
                 # 更新邮件发件人
                 msg.replace_header('From', formataddr(["WecountsMonitor", account['username']]))
                 
-                async with aiosmtplib.SMTP(
-                    hostname=email_config['smtp_server'],
-                    port=email_config['smtp_port'],
-                    use_tls=True
-                ) as smtp:
-                    await smtp.login(account['username'], account['password'])
-                    await smtp.send_message(msg)
-                    self.logger(f"Email alert sent to {recipient} using {account['username']}")
-                    return True
+                # 复用该账号已登录的连接，避免每封邮件都重新握手和登录
+                await self.smtp_pool.send_message(account, msg)
+                self.record_smtp_send(account, 1, True, started)
+                self.record_delivered(ledger, [recipient])
+                self.logger(f"Email alert sent to {recipient} using {account['username']}")
+                return True
             except Exception as e:
-                self.logger(f"Failed to send email to {recipient} using {account['username']}: {e}")
-                if i < len(email_config['accounts']) - 1:
-                    self.logger(f"Trying next email account...")
-                    continue
-                else:
-                    self.logger(f"All email accounts failed when sending to {recipient}")
-                    return False
-        
-        return False
+                self.record_smtp_send(account, 1, False, started)
+                self.logger(f"Failed to send email to {recipient} using {account['username']}: {e}", level="ERROR")
+                self.handle_send_failure(account, 1, e)
 
-    async def send_email_alert_async(self, article_data, keywords):
-        """异步发送邮件提醒到所有接收者"""
-        try:
-            email_config = self.config['email']
-            recipients = email_config['recipients']
-            
-            # 默认使用第一个账号作为发件人
-            default_username = email_config['accounts'][0]['username']
-            
-            # 读取图片文件
+    async def send_batch_async(self, msg, recipients, ledger=None):
+        """以一封邮件、多个 RCPT TO 信封收件人的方式批量发送（相当于密送）
+        
+        服务器对每个 RCPT TO 单独应答，被拒收的收件人不影响其他人；只有连接、登录等
+        整体失败时才切换到下一个发件账号。
+        
+        Args:
+            ledger: 发送成功后记入发送账本的 (文章键, 邮件类型) 列表
+        
+        Returns:
+            dict: 收件人 -> 是否被服务器接受
+        """
+        import aiosmtplib
+        
+        tried = set()
+        
+        while True:
+            account = await self.acquire_sender(len(recipients), tried)
+            if account is None:
+                self.logger(f"All email accounts failed or exhausted when sending batch of {len(recipients)}", level="ERROR")
+                return {recipient: False for recipient in recipients}
+            tried.add(account['username'])
+            started = time.monotonic()
             try:
-                with open("img.jpg", "rb") as img_file:
-                    img_data = img_file.read()
-                image_found = True
+                self.logger(f"Trying to send batch of {len(recipients)} emails using account {account['username']} (attempt {len(tried)}/{len(self.sender_pool.accounts)})", level="DEBUG")
+                msg.replace_header('From', formataddr(["WecountsMonitor", account['username']]))
+                refused, _ = await self.smtp_pool.send_message(account, msg, recipients=recipients)
+                self.record_smtp_send(account, len(recipients), True, started)
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                self.record_smtp_send(account, len(recipients), False, started)
+                # 所有收件人都被拒收，换账号也无济于事；没有发出的邮件不占用发件账号的配额
+                self.sender_pool.release(account['username'], len(recipients))
+                for refusal in e.recipients:
+                    self.logger(f"Recipient {refusal.recipient} refused: {refusal.code} {refusal.message}")
+                return {recipient: False for recipient in recipients}
             except Exception as e:
-                self.logger(f"Error reading image file: {e}")
-                image_found = False
+                self.record_smtp_send(account, len(recipients), False, started)
+                self.logger(f"Failed to send batch using {account['username']}: {e}", level="ERROR")
+                self.handle_send_failure(account, len(recipients), e)
+                continue
             
-            # 创建所有邮件的任务
-            tasks = []
-            for recipient in recipients:
-                msg = MIMEMultipart()
-                msg['From'] = formataddr(["WecountsMonitor", default_username])
-                msg['To'] = recipient
-                msg['Subject'] = f"关键词提醒: {', '.join(keywords)} - {article_data['title']}"
-                
-                # 如果图片存在，添加图片作为内联附件
-                img_cid = None
-                if image_found:
-                    img = MIMEImage(img_data)
-                    img.add_header('Content-ID', '<attached_image>')
-                    img.add_header('Content-Disposition', 'inline', filename='img.jpg')
-                    msg.attach(img)
-                    img_cid = 'attached_image'
-                
-                # 构建邮件内容
-                html_content = f"""
-                <html>
-                <head>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
-                        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                        .header {{ background-color: #f8f9fa; padding: 10px; border-bottom: 1px solid #e9ecef; }}
-                        .footer {{ margin-top: 20px; font-size: 12px; color: #6c757d; }}
-                        .highlight {{ background-color: yellow; font-weight: bold; }}
-                        .image-container {{ text-align: center; margin: 20px 0; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="header">
-                            <h2>{article_data['title']}</h2>
-                            <p>作者: {article_data['author']}</p>
-                        </div>
-                        <div class="content">
-                            <p>在文章《{article_data['title']}》中发现关键词: <span class="highlight">{', '.join(keywords)}</span></p>
-                            <p>文章链接: <a href="{article_data['url']}">{article_data['url']}</a></p>
-                            <p>监控时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                            <p>有疑问扫码咨询</p>
-                            {f'<div class="image-container"><img src="cid:{img_cid}" alt="附图" style="max-width:100%;"></div>' if img_cid else ''}
-                        </div>
-                        <div class="footer">
-                            <p>此邮件由WecountsMonitor自动发送，请勿回复。</p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                msg.attach(MIMEText(html_content, 'html', 'utf-8'))
-                
-                # 创建发送任务
-                task = asyncio.create_task(self.send_email_async(msg, recipient))
-                tasks.append(task)
+            self.record_delivered(ledger, [recipient for recipient in recipients if recipient not in refused])
+            if refused:
+                # 被拒收的收件人不占用发件账号的配额
+                self.sender_pool.release(account['username'], min(len(refused), len(recipients)))
+            for recipient, response in refused.items():
+                self.logger(f"Recipient {recipient} refused: {response.code} {response.message}")
+            accepted = len(recipients) - len(refused)
+            self.logger(f"Email alert sent to {accepted}/{len(recipients)} recipients in one batch using {account['username']}")
+            return {recipient: recipient not in refused for recipient in recipients}
+    
+    def log_sender_usage(self):
+        """记录各发件账号最近24小时的发送量并保存"""
+        usage = self.sender_pool.usage()
+        self.logger("Sender usage (24h): " + ", ".join(
+            f"{username} {count}/{self.sender_pool.daily_limit}" for username, count in usage.items()
+        ))
+        self.sender_pool.save()
+    
+    async def deliver_async(self, subject, parts, recipients, ledger=None):
+        """把同一内容的邮件发给一组收件人，按配置逐个发送或批量发送
+        
+        Args:
+            subject: 邮件主题
+            parts: 共享的MIME部件（图片、正文）
+            recipients: 收件人列表
+            ledger: 每个收件人被接受后记入发送账本的 (文章键, 邮件类型) 列表
             
-            # 等待所有邮件发送完成
-            results = await asyncio.gather(*tasks)
-            success_count = sum(1 for r in results if r)
-            self.logger(f"Email sending completed. Success: {success_count}/{len(recipients)}")
-            return success_count > 0
+        Returns:
+            dict: 收件人 -> 是否发送成功
+        """
+        email_config = self.config['email']
+        # 默认使用第一个账号作为发件人
+        default_username = email_config['accounts'][0]['username']
+        
+        # 批量模式：每批收件人只发一封邮件，收件人放在信封中而不出现在头部
+        if email_config.get('delivery_mode', 'individual') == 'batch':
+            batch_size = max(1, int(email_config.get('batch_size', 50)))
+            batches = [recipients[i:i + batch_size] for i in range(0, len(recipients), batch_size)]
+            tasks = [
+                asyncio.create_task(self.send_batch_async(
+                    build_message(default_username, "undisclosed-recipients:;", subject, parts),
+                    batch,
+                    ledger
+                ))
+                for batch in batches
+            ]
+            accepted = {}
+            for result in await asyncio.gather(*tasks):
+                accepted.update(result)
+            success_count = sum(1 for ok in accepted.values() if ok)
+            self.logger(f"Email sending completed in {len(batches)} batch(es). Success: {success_count}/{len(recipients)}")
+            self.log_sender_usage()
+            return accepted
+        
+        # 创建所有邮件的任务，每封邮件只生成收件人相关的头部
+        tasks = []
+        for recipient in recipients:
+            msg = build_message(default_username, recipient, subject, parts)
+            task = asyncio.create_task(self.send_email_async(msg, recipient, ledger))
+            tasks.append(task)
+        
+        # 等待所有邮件发送完成
+        results = await asyncio.gather(*tasks)
+        success_count = sum(1 for r in results if r)
+        self.logger(f"Email sending completed. Success: {success_count}/{len(recipients)}")
+        self.logger(f"SMTP pool: {self.smtp_pool.stats['logins']} logins, {self.smtp_pool.stats['messages']} messages, "
+                    f"{self.smtp_pool.stats['reconnects']} reconnects")
+        self.log_sender_usage()
+        return dict(zip(recipients, results))
+    
+    async def deliver_alert_async(self, article_data, keywords, recipients, article_key=None):
+        """渲染并发送一条关键词提醒
+        
+        Args:
+            article_key: 规范文章键，给出时每个收件人被接受后立即记入发送账本
+        
+        Returns:
+            dict: 收件人 -> 是否发送成功
+        """
+        # 图片和正文只编码、渲染一次，所有收件人共用
+        image_part = self.inline_image.get()
+        if image_part is None:
+            self.logger(f"Inline image not available: {self.inline_image.image_path}")
+        body_part = html_part(render_alert_html(
+            article_data,
+            keywords,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            img_cid=IMAGE_CID if image_part else None
+        ))
+        subject = f"关键词提醒: {', '.join(keywords)} - {article_data['title']}"
+        ledger = [(article_key, 'alert')] if article_key is not None else None
+        return await self.deliver_async(subject, [image_part, body_part], recipients, ledger)
+    
+    async def send_digest_async(self, items, article_keys=None):
+        """把多篇命中文章合并成每个收件人一封的汇总提醒
+        
+        订阅到完全相同文章集合的收件人共用一份渲染好的正文（批量模式下也共用同一封邮件）。
+        
+        Args:
+            items: (article_data, keywords, recipients) 列表
+            article_keys: 与 items 对应的规范文章键，给出时每个收件人被接受后立即记入
+                发送账本（汇总邮件中的每篇文章各记一条）
             
-        except Exception as e:
-            self.logger(f"Failed to send emails: {e}")
+        Returns:
+            dict: 收件人 -> 是否发送成功
+        """
+        # 收件人 -> 其订阅命中的文章下标
+        recipient_items = {}
+        for index, (_, _, recipients) in enumerate(items):
+            for recipient in recipients:
+                recipient_items.setdefault(recipient, []).append(index)
+        
+        groups = {}
+        for recipient, indexes in recipient_items.items():
+            groups.setdefault(tuple(indexes), []).append(recipient)
+        
+        image_part = self.inline_image.get()
+        monitor_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        accepted = {}
+        for indexes, recipients in groups.items():
+            group_items = [(items[i][0], items[i][1]) for i in indexes]
+            body_part = html_part(render_digest_html(
+                group_items,
+                monitor_time,
+                img_cid=IMAGE_CID if image_part else None
+            ))
+            keywords = list(dict.fromkeys(k for _, item_keywords in group_items for k in item_keywords))
+            subject = f"关键词提醒: {', '.join(keywords)} - {len(group_items)}篇文章"
+            ledger = [(article_keys[i], 'alert') for i in indexes] if article_keys is not None else None
+            accepted.update(await self.deliver_async(subject, [image_part, body_part], recipients, ledger))
+        
+        success_count = sum(1 for ok in accepted.values() if ok)
+        self.logger(f"Digest of {len(items)} article(s) sent as {len(groups)} variant(s). Success: {success_count}/{len(recipient_items)}")
+        return accepted
+    
+    def queue_alert(self, account, article_data, keywords, article_key=None):
+        """把一条关键词提醒写入待发队列
+        
+        汇总模式下先暂存，由 flush_digest 在本轮结束或汇总窗口到期时放行，
+        投递任务再把放行的提醒合并发送。同一篇文章只会写入一次。
+        
+        Args:
+            article_key: 规范文章键，默认由文章链接计算
+        
+        Returns:
+            bool: 是否写入了队列（没有订阅的收件人或已写入过时不写入）
+        """
+        # 只发给订阅了命中关键词和该公众号的收件人
+        recipients = self.subscriptions.recipients_for(keywords, account)
+        if not recipients:
+            self.logger(f"No recipients subscribed to {', '.join(keywords)} from {account}")
             return False
-
-    def send_email_alert(self, article_data, keywords):
-        """同步发送邮件提醒的包装函数"""
-        return self.loop.run_until_complete(self.send_email_alert_async(article_data, keywords))
+        
+        if article_key is None:
+            article_key = canonical_article_key(article_data['url'])
+        
+        payload = self.alert_payload(account, article_key, article_data, keywords, recipients)
+        digest = self.digest_config.get('enabled', False)
+        spool_id = self.mail_spool.enqueue('alert', payload, hold=digest, dedupe_key=article_key)
+        if spool_id is None:
+            self.logger(f"Alert already queued: {article_data['title']}")
+            return False
+        self.events.emit('alert_queued', account=account, article_key=article_key, spool_id=spool_id,
+                         recipients=len(recipients), held=digest)
+        if digest:
+            self.logger(f"Queued article for digest: {article_data['title']}")
+        else:
+            self.logger(f"Queued alert for {len(recipients)} recipient(s): {article_data['title']}")
+            self.notify_delivery()
+        return True
+    
+    def alert_payload(self, account, article_key, article_data, keywords, recipients):
+        """队列中一条提醒的内容（正文只用于匹配，提醒邮件不需要）"""
+        return {
+            "account": account,
+            "article_key": article_key,
+            "article": {key: article_data[key] for key in ('title', 'author', 'url')},
+            "keywords": keywords,
+            "recipients": list(recipients)
+        }
+    
+    def send_email_alert(self, article_data, keywords, recipients=None):
+        """立即发送一条邮件提醒（用于测试邮件配置）
+        
+        与抓取到的提醒一样先写入待发队列再发送，发送前经过发送账本过滤，
+        重复调用或重试时已收到的收件人不会再收到。
+        
+        Args:
+            recipients: 收件人列表，默认为全部收件人
+        
+        Returns:
+            bool: 是否所有收件人都已收到
+        """
+        if recipients is None:
+            recipients = self.config['email']['recipients']
+        article_key = canonical_article_key(article_data['url'])
+        payload = self.alert_payload(None, article_key, article_data, keywords, recipients)
+        if self.mail_spool.enqueue('alert', payload, dedupe_key=article_key) is None:
+            self.logger(f"Alert already queued: {article_data['title']}")
+        self.drain_spool()
+        return not self.delivery_ledger.undelivered(article_key, 'alert', recipients)
+    
+    def flush_digest(self, force=False):
+        """汇总窗口到期（或 force）时放行暂存的汇总提醒
+        
+        汇总模式在运行中被关闭时，已暂存的提醒不再等待窗口，立即放行。
+        """
+        if force or not self.digest_config.get('enabled', False):
+            window_seconds = 0
+        else:
+            window_seconds = self.digest_config.get('window_minutes', 0) * 60
+        released = self.mail_spool.release_held(window_seconds)
+        if released:
+            self.logger(f"Released {released} article(s) for digest delivery")
+            self.notify_delivery()
     
     def process_registrations(self):
-        """处理注册CSV文件，更新收件人列表并发送欢迎邮件"""
-        self.logger("Processing registration file...")
-        reg_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reg.csv")
+        """增量处理注册CSV文件中新追加的行，更新收件人列表并发送欢迎邮件
         
-        if not os.path.exists(reg_file):
-            self.logger(f"Registration file not found: {reg_file}")
+        文件没有变化时只做一次 stat，因此可以频繁轮询。
+        """
+        if not self.registration_reader.changed():
             return
-        
-        try:
-            # 读取CSV文件
-            df = pd.read_csv(reg_file)
-            if '邮箱' not in df.columns:
-                self.logger("CSV file does not contain '邮箱' column")
-                return
+        with self.config_lock:
+            self.logger("Processing registration file...")
             
-            # 清理邮箱数据：去除空值和无效值
-            emails = df['邮箱'].dropna().tolist()
-            valid_emails = [email.strip() for email in emails if email.strip() and '@' in email]
-            
-            if not valid_emails:
-                self.logger("No valid emails found in registration file")
-                return
+            try:
+                rows = self.registration_reader.read_new_rows()
+                if rows and '邮箱' not in rows[0]:
+                    self.logger("CSV file does not contain '邮箱' column")
+                    self.registration_reader.save_state()
+                    return
             
-            # 加载当前配置
-            current_recipients = set(self.config['email']['recipients'])
+                # 邮箱规范化后通过索引去重，同一邮箱大小写不同也只加入一次
+                new_emails = []
+                subscriptions = self.config['email'].setdefault('subscriptions', {})
+                for row in rows:
+                    email = self.recipient_store.add(row.get('邮箱'))
+                    if email is None:
+                        continue
+                    new_emails.append(email)
             
-            # 找出新添加的邮箱
-            new_emails = [email for email in valid_emails if email not in current_recipients]
+                    # 读取可选的订阅关键词/公众号列
+                    subscription = {
+                        "keywords": parse_subscription_field(row.get('订阅关键词')),
+                        "accounts": parse_subscription_field(row.get('订阅公众号'))
+                    }
+                    if subscription['keywords'] or subscription['accounts']:
+                        subscriptions[email] = subscription
             
-            if not new_emails:
-                self.logger("No new emails to add")
-                return
+                if not new_emails:
+                    self.logger(f"No new emails to add ({len(rows)} new row(s) read)")
+                    self.registration_reader.save_state()
+                    return
             
-            # 更新配置
-            self.config['email']['recipients'] = list(current_recipients.union(set(new_emails)))
+                self.rebuild_subscriptions()
             
-            # 保存更新后的配置
-            config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=4)
+                # 先把欢迎邮件写入待发队列再保存配置，中途退出时下次仍会识别为新邮箱
+                self.mail_spool.enqueue('welcome', {"recipients": new_emails})
+                self.notify_delivery()
             
-            self.logger(f"Added {len(new_emails)} new emails to recipients list")
+                # 保存更新后的配置，这次写入不触发重新加载
+                with open(self.config_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.config, f, ensure_ascii=False, indent=4)
+                self.config_watcher.acknowledge(self.config_path)
+                self.registration_reader.save_state()
             
-            # 发送欢迎邮件给新添加的收件人
-            self.send_welcome_emails(new_emails)
+                self.logger(f"Added {len(new_emails)} new emails to recipients list")
             
-        except Exception as e:
-            self.logger(f"Error processing registration file: {e}")
+            except Exception as e:
+                self.logger(f"Error processing registration file: {e}", level="ERROR")
     
-    async def send_welcome_email_async(self, recipient):
+    async def send_welcome_email_async(self, recipient, ledger=None):
         """异步发送欢迎邮件"""
         try:
             email_config = self.config['email']
             default_username = email_config['accounts'][0]['username']
             
-            # 读取图片文件
-            try:
-                img_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "img.jpg")
-                with open(img_path, "rb") as img_file:
-                    img_data = img_file.read()
-                image_found = True
-            except Exception as e:
-                self.logger(f"Error reading image file: {e}")
-                image_found = False
-            
-            msg = MIMEMultipart()
-            msg['From'] = formataddr(["WecountsMonitor", default_username])
-            msg['To'] = recipient
-            msg['Subject'] = "WecountsMonitor注册成功"
-            
-            # 如果图片存在，添加图片作为内联附件
-            img_cid = None
-            if image_found:
-                img = MIMEImage(img_data)
-                img.add_header('Content-ID', '<attached_image>')
-                img.add_header('Content-Disposition', 'inline', filename='img.jpg')
-                msg.attach(img)
-                img_cid = 'attached_image'
-            
-            # 构建邮件内容
-            html_content = f"""
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
-                    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                    .header {{ background-color: #f8f9fa; padding: 10px; border-bottom: 1px solid #e9ecef; }}
-                    .content {{ padding: 20px 0; }}
-                    .footer {{ margin-top: 20px; font-size: 12px; color: #6c757d; }}
-                    .image-container {{ text-align: center; margin: 20px 0; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h2>WecountsMonitor注册成功</h2>
-                    </div>
-                    <div class="content">
-                        <p>致 RUCer，</p>
-                        <p><strong>收到该邮件证明您的邮箱已加入WecountsMonitor的提醒列表。</strong></p>
-                        <p>欢迎大家使用免费开源的WecountsMonitor，该服务主要是为了方便大家火速报名形势与政策讲座 & 志愿活动，帮助高年级同学顺利毕业写的！</p>
-                        <p>🌟 如果任何bug / 接收不到邮件 / 改进建议，欢迎扫描附件二维码加入反馈群进行吐槽。如果有其他开发建议或insights，也欢迎加入"WecountsMonitor"群聊进行讨论～ 🌟</p>
-                        <p>来自WecountsMonitor开发组</p>
-                        {f'<div class="image-container"><img src="cid:{img_cid}" alt="二维码" style="max-width:100%;"></div>' if img_cid else ''}
-                    </div>
-                    <div class="footer">
-                        <p>（此邮件由WecountsMonitor自动发送，请勿回复）</p>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            
-            msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+            # 欢迎邮件正文固定，编码后的部件按是否带图片缓存
+            image_part = self.inline_image.get()
+            has_image = image_part is not None
+            if has_image not in self.welcome_body_parts:
+                self.welcome_body_parts[has_image] = html_part(
+                    render_welcome_html(img_cid=IMAGE_CID if has_image else None)
+                )
+            msg = build_message(
+                default_username,
+                recipient,
+                "WecountsMonitor注册成功",
+                [image_part, self.welcome_body_parts[has_image]]
+            )
             
             # 使用带备用邮箱机制的发送函数
-            return await self.send_email_async(msg, recipient)
+            return await self.send_email_async(msg, recipient, ledger)
             
         except Exception as e:
-            self.logger(f"Failed to create welcome email for {recipient}: {e}")
+            self.logger(f"Failed to create welcome email for {recipient}: {e}", level="ERROR")
             return False
 
-    def send_welcome_emails(self, recipients):
-        """发送欢迎邮件给新注册的用户"""
-        if not recipients:
-            return
+    async def deliver_welcome_async(self, recipients, ledger=None):
+        """发送欢迎邮件给一组新注册的用户
         
+        Args:
+            ledger: 每个收件人被接受后记入发送账本的 (文章键, 邮件类型) 列表
+        
+        Returns:
+            dict: 收件人 -> 是否发送成功
+        """
         self.logger(f"Sending welcome emails to {len(recipients)} new recipients")
+        results = await asyncio.gather(*(self.send_welcome_email_async(recipient, ledger) for recipient in recipients))
+        success_count = sum(1 for r in results if r)
+        self.logger(f"Welcome email sending completed. Success: {success_count}/{len(recipients)}")
+        return dict(zip(recipients, results))
+
+    def run_coroutine(self, coro):
+        """在监控程序的事件循环中运行协程并等待结果（供测试脚本等同步调用方使用）
         
+        SMTP连接池只在这个事件循环中使用。serve() 运行期间事件循环已被占用，
+        不能再同步等待，此时应在事件循环中直接 await 对应的协程。
+        """
+        if self.loop.is_running():
+            coro.close()
+            raise RuntimeError("run_coroutine() cannot be used while the monitor's event loop is running; "
+                               "await the coroutine instead")
+        return self.loop.run_until_complete(coro)
+    
+    def notify_delivery(self):
+        """唤醒投递任务（可在任意线程中调用）"""
+        if self.delivery_wakeup is not None:
+            self.loop.call_soon_threadsafe(self.delivery_wakeup.set)
+    
+    def notify_poller(self):
+        """唤醒抓取任务重新检查到期的公众号（可在任意线程中调用）"""
+        if self.poll_wakeup is not None:
+            self.loop.call_soon_threadsafe(self.poll_wakeup.set)
+    
+    def request_stop(self):
+        """请求停止运行（可在任意线程或信号处理函数中调用）"""
+        if self.stop_event is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+    
+    def ledger_key(self, kind, payload):
+        """队列邮件在发送账本中的文章键，欢迎邮件没有对应文章"""
+        if kind == 'alert':
+            return payload.get('article_key') or canonical_article_key(payload['article']['url'])
+        return ''
+    
+    def undelivered_payload(self, kind, payload):
+        """去掉发送账本中已收到该邮件的收件人"""
+        recipients = self.delivery_ledger.undelivered(self.ledger_key(kind, payload), kind, payload['recipients'])
+        if len(recipients) < len(payload['recipients']):
+            self.logger(f"Skipping {len(payload['recipients']) - len(recipients)} recipient(s) "
+                        f"who already received this {kind}")
+        return dict(payload, recipients=recipients)
+    
+    async def deliver_spooled(self, item_id, kind, payload, attempts):
+        """发送一条队列中的邮件，只发给尚未收到的收件人，只对发送失败的收件人安排重试
+        
+        每个收件人被服务器接受后立即记入发送账本，投递中途被打断时已收到的人不会重发。
+        """
+        payload = self.undelivered_payload(kind, payload)
+        recipients = payload['recipients']
+        error = None
+        if not recipients:
+            self.settle_spooled(item_id, kind, payload, attempts, {})
+            return
+        started = time.monotonic()
         try:
-            # 创建异步任务
-            async def send_all_welcome_emails():
-                tasks = [self.send_welcome_email_async(recipient) for recipient in recipients]
-                results = await asyncio.gather(*tasks)
-                success_count = sum(1 for r in results if r)
-                self.logger(f"Welcome email sending completed. Success: {success_count}/{len(recipients)}")
-                return success_count > 0
-            
-            # 运行异步任务
-            return self.loop.run_until_complete(send_all_welcome_emails())
-            
+            if kind == 'alert':
+                accepted = await self.deliver_alert_async(
+                    payload['article'], payload['keywords'], recipients, self.ledger_key(kind, payload)
+                )
+            elif kind == 'welcome':
+                accepted = await self.deliver_welcome_async(recipients, [(self.ledger_key(kind, payload), kind)])
+            else:
+                raise ValueError(f"Unknown mail kind: {kind}")
         except Exception as e:
-            self.logger(f"Failed to send welcome emails: {e}")
-            return False
+            self.logger(f"Failed to deliver spooled {kind} #{item_id}: {e}", level="ERROR")
+            accepted, error = {}, e
+        self.settle_spooled(item_id, kind, payload, attempts, accepted, error, duration=time.monotonic() - started)
+    
+    def settle_spooled(self, item_id, kind, payload, attempts, accepted, error=None, duration=0.0):
+        """根据发送结果把队列记录标记为完成或安排重试（发送账本已在每个收件人被接受时写入）"""
+        delivered = [recipient for recipient in payload['recipients'] if accepted.get(recipient)]
+        if delivered:
+            if kind == 'alert':
+                self.logger(f"Email alert sent to {len(delivered)} recipient(s) for article: {payload['article']['title']}")
+        failed = [recipient for recipient in payload['recipients'] if not accepted.get(recipient)]
+        event = {
+            "kind": kind, "spool_id": item_id, "account": payload.get('account'),
+            "article_key": payload.get('article_key'), "recipients": len(delivered),
+            "attempt": attempts, "duration_ms": round(duration * 1000, 1)
+        }
+        if not failed:
+            self.mail_spool.mark_sent(item_id)
+            if delivered:
+                self.events.emit('email_sent', **event)
+            return
+        
+        payload = dict(payload, recipients=failed)
+        delay = self.mail_spool.mark_retry(
+            item_id, attempts, error or f"{len(failed)} recipient(s) failed", payload=payload
+        )
+        self.events.emit('email_failed', failed=len(failed), retry_in=delay, **event)
+        if delay is None:
+            self.logger(f"Giving up on spooled {kind} #{item_id} after {attempts} attempts, "
+                        f"{len(failed)} recipient(s) not delivered", level="ERROR")
+        else:
+            self.logger(f"Retrying spooled {kind} #{item_id} for {len(failed)} recipient(s) in {delay:.0f} seconds")
+    
+    async def deliver_spooled_digest(self, items):
+        """把一批队列中的提醒合并成汇总邮件发送，每篇文章只发给尚未收到的收件人"""
+        items = [
+            (item_id, kind, self.undelivered_payload(kind, payload), attempts)
+            for item_id, kind, payload, attempts in items
+        ]
+        pending = [(kind, payload) for _, kind, payload, _ in items if payload['recipients']]
+        digest_items = [(payload['article'], payload['keywords'], payload['recipients']) for _, payload in pending]
+        article_keys = [self.ledger_key(kind, payload) for kind, payload in pending]
+        error = None
+        started = time.monotonic()
+        try:
+            accepted = await self.send_digest_async(digest_items, article_keys) if digest_items else {}
+        except Exception as e:
+            self.logger(f"Failed to send digest: {e}", level="ERROR")
+            accepted, error = {}, e
+        duration = time.monotonic() - started
+        for item_id, kind, payload, attempts in items:
+            self.settle_spooled(item_id, kind, payload, attempts, accepted, error, duration=duration)
+    
+    async def drain_spool_async(self):
+        """发送一批已到期的待发邮件，同时进行的发送不超过 delivery_concurrency 条
+        
+        Returns:
+            int: 处理的记录数
+        """
+        processed = 0
+        kind = None
+        if self.digest_config.get('enabled', False):
+            # 汇总模式下所有已放行的提醒合并成一次汇总发送
+            alerts = self.mail_spool.claim_due(self.DIGEST_BATCH_LIMIT, kind='alert')
+            if alerts:
+                await self.deliver_spooled_digest(alerts)
+                processed += len(alerts)
+            kind = 'welcome'
+        
+        items = self.mail_spool.claim_due(self.delivery_concurrency, kind=kind)
+        if items:
+            await asyncio.gather(*(self.deliver_spooled(*item) for item in items))
+            processed += len(items)
+        return processed
+    
+    async def delivery_worker(self):
+        """持续发送队列中的邮件：有新邮件写入时被唤醒，否则等到最早的重试时间
+        
+        停止时发完当前这批邮件后退出，其余邮件留在队列中，下次启动继续发送。
+        """
+        self.delivery_wakeup = asyncio.Event()
+        counts = self.mail_spool.counts()
+        self.logger(f"Delivery worker started: {counts.get('pending', 0)} pending, {counts.get('held', 0)} held")
+        while not self.stop_event.is_set():
+            try:
+                if await self.drain_spool_async():
+                    continue
+            except Exception as e:
+                traceback.print_exc()
+                self.logger(f"Error in delivery worker: {e}", level="ERROR")
+            
+            due_in = self.mail_spool.next_due_in()
+            timeout = self.DELIVERY_POLL_SECONDS if due_in is None else min(due_in, self.DELIVERY_POLL_SECONDS)
+            try:
+                await asyncio.wait_for(self.delivery_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.delivery_wakeup.clear()
+    
+    def drain_spool(self):
+        """立即发送队列中所有已到期的邮件（未启动投递任务时使用）"""
+        async def drain():
+            while await self.drain_spool_async():
+                pass
+        self.run_coroutine(drain())
     
     def process_articles(self, account_name, articles):
-        """处理文章列表，检查新文章中的关键词"""
+        """处理文章列表，检查新文章中的关键词
+        
+        命中关键词的文章先写入待发队列再标记为已检查，进程在两者之间退出时
+        下一轮会重新检查该文章，提醒不会丢失。
+        
+        Returns:
+            list: 命中关键词的 (article_data, keywords) 列表
+        """
+        matches = []
         for article in articles:
             article_url = article['link']
+            # 同一篇文章的不同链接（chksm等参数不同）对应同一个规范键
+            article_key = canonical_article_key(article_url)
             
             # 跳过已经检查过的文章
-            if article_url in self.checked_articles:
+            if article_key in self.checked_articles:
                 self.logger(f"Skipping already checked article: {article['title']}")
                 continue
             
             self.logger(f"Checking new article: {article['title']} - {article_url}")
             
-            # 检查文章发布时间，如果超过8小时则跳过
+            # 检查文章发布时间，如果超过时效窗口（默认8小时）则跳过
             try:
                 # 将字符串时间转换为datetime对象
                 publish_time = datetime.strptime(article['create_time'], "%Y-%m-%d %H:%M:%S")
                 current_time = datetime.now()
                 time_diff = current_time - publish_time
                 
-                if time_diff.total_seconds() > 8 * 3600:  # 8小时 = 8 * 3600秒
-                    self.logger(f"Skipping article older than 8 hours: {article['title']}")
+                if time_diff.total_seconds() > self.max_article_age_hours * 3600:
+                    self.logger(f"Skipping article older than {self.max_article_age_hours} hours: {article['title']}")
+                    self.events.emit('article_seen', account=account_name, article_key=article_key,
+                                     title=article['title'], publish_time=article.get('timestamp'), skipped="too old")
                     # 标记为已检查，避免下次再处理
-                    self.checked_articles[article_url] = {
-                        "title": article['title'],
-                        "check_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "skipped": "too old"
-                    }
+                    self.checked_articles.mark(
+                        article_key,
+                        article['title'],
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        account=account_name,
+                        skipped="too old",
+                        publish_time=article.get('timestamp')
+                    )
                     continue
             except Exception as e:
-                self.logger(f"Error parsing article time: {e}, using current time instead")
+                self.logger(f"Error parsing article time: {e}, using current time instead", level="WARNING")
                 # 如果时间解析失败，使用当前时间作为发布时间，继续处理文章
                 publish_time = datetime.now()
+            self.events.emit('article_seen', account=account_name, article_key=article_key,
+                             title=article['title'], publish_time=article.get('timestamp'), skipped=None)
             
             # 获取文章内容
-            article_data = self.fetch_article_content(article_url)
+            article_data = self.fetch_article_content(article_url, account_name=account_name)
             if not article_data:
-                self.logger(f"Failed to fetch content for {article_url}")
+                self.logger(f"Failed to fetch content for {article_url}", level="ERROR")
                 continue
             
-            # 标记为已检查
-            self.checked_articles[article_url] = {
-                "title": article['title'],
-                "check_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            # 检查标题和内容中是否包含关键词
-            title_keywords = self.check_keywords(article_data['title'])
-            content_keywords = self.check_keywords(article_data['content'])
-            all_keywords = list(set(title_keywords + content_keywords))
+            # 标题和内容拼接后一次扫描，关键词不含换行，不会跨越两者误匹配
+            text = f"{article_data['title']}\n{article_data['content']}"
+            started = time.monotonic()
+            all_keywords = self.check_keywords(text)
+            self.events.emit('keywords_scanned', account=account_name, article_key=article_key, chars=len(text),
+                             matches=len(all_keywords), duration_ms=round((time.monotonic() - started) * 1000, 3))
             
             if all_keywords:
                 self.logger(f"Found keywords in article: {', '.join(all_keywords)}")
-                self.send_email_alert(article_data, all_keywords)
+                self.events.emit('match', account=account_name, article_key=article_key, keywords=all_keywords)
+                self.queue_alert(account_name, article_data, all_keywords, article_key=article_key)
+                matches.append((article_data, all_keywords))
             else:
                 self.logger(f"No keywords found in article")
+            
+            # 标记为已检查
+            self.checked_articles.mark(
+                article_key,
+                article['title'],
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                account=account_name,
+                publish_time=article.get('timestamp')
+            )
+        
+        return matches
+    
+    def poll_account(self, account):
+        """抓取单个公众号并检查新文章（在工作线程中运行）"""
+        started = time.monotonic()
+        articles, complete = self.fetch_account_articles(account)
+        if articles:
+            self.publish_history.record(account, [a['timestamp'] for a in articles])
+        matches = self.process_articles(account, articles) if articles else []
+        if complete:
+            self.advance_account_cursor(account, articles)
+        self.events.emit('poll_completed', account=account, articles=len(articles), matches=len(matches),
+                         complete=complete, duration_ms=round((time.monotonic() - started) * 1000, 1))
+        return matches
     
-    def run_once(self):
-        """运行一次监控流程"""
+    async def run_once_async(self, accounts=None):
+        """运行一次监控流程
+        
+        多个公众号在抓取线程池中并发抓取，请求频率由共享的令牌桶统一控制，
+        因此一轮耗时取决于请求预算而不是公众号数量。命中的提醒写入待发队列，
+        由同一事件循环中的投递任务发送，抓取和SMTP发送互不等待。
+        
+        Args:
+            accounts: 本轮要抓取的公众号，默认为全部
+        """
         self.logger("Starting monitoring process...")
+        accounts = self.config['accounts'] if accounts is None else accounts
+        loop = asyncio.get_running_loop()
         
-        for account in self.config['accounts']:
+        async def poll(account):
             try:
-                self.logger(f"Fetching latest article for: {account}")
-                # 获取公众号最新文章
-                articles = self.fetch_account_articles(account)
-                if articles:
-                    self.process_articles(account, articles)
-                else:
-                    self.logger(f"No articles found for {account}")
-                
-                # 每处理完一个公众号后休眠1分钟
-                if account != self.config['accounts'][-1]:  # 如果不是最后一个账号
-                    self.logger(f"Sleeping for 1 minutes after processing {account}")
-                    time.sleep(30)  # 休眠1分钟
-                
+                await loop.run_in_executor(self.poll_executor, self.poll_account, account)
             except Exception as e:
                 traceback.print_exc()
-                self.logger(f"Error processing account {account}: {e}")
+                self.logger(f"Error processing account {account}: {e}", level="ERROR")
+            # 停止时被取消的公众号没有抓取，不记为已轮询，恢复后仍然到期
+            if self.scheduler:
+                self.scheduler.mark_polled(account)
         
-        # 保存检查过的文章记录
-        self.save_checked_articles()
+        await asyncio.gather(*(poll(account) for account in accounts))
+        await asyncio.to_thread(self.finish_round)
+    
+    def finish_round(self):
+        """一轮抓取结束后放行汇总提醒并保存抓取状态"""
+        self.last_round_at = time.time()
+        # 汇总模式下，窗口为0时每轮结束即放行
+        self.flush_digest()
+        
+        # 保存游标（已检查的文章在处理时已逐条写入数据库）
+        self.save_account_cursors()
+        self.publish_history.save()
+        if self.scheduler:
+            self.scheduler.rebuild()
+        for host, stats in self.crawler.get_pool_stats().items():
+            self.logger(f"Connection pool {host}: {stats['connections_opened']} connections, "
+                        f"{stats['requests']} requests, {stats['idle_connections']} idle")
         self.logger("Monitoring process completed")
+    
+    def run_once(self, accounts=None):
+        """同步运行一次监控流程（见 run_once_async）"""
+        self.run_coroutine(self.run_once_async(accounts))
 
-    def start_scheduler(self):
-        """启动定时任务"""
-        interval_hours = self.config.get('interval_hours', 1)
-        self.logger(f"Scheduling monitoring every {interval_hours} hour(s)")
-        self.process_registrations()
-        # 立即运行一次
-        self.run_once()
-        
-        # 立即处理注册
+    def compact_history(self):
+        """淘汰超过保留期限的已检查文章
         
+        发布时间早于时效窗口的文章即使再次出现在列表中也只会被标记为 "too old"，
+        不会再获取内容或发送提醒，因此保留期限不短于时效窗口即可安全删除。
+        """
+        cutoff = time.time() - self.retention_hours * 3600
+        try:
+            evicted = self.checked_articles.evict_older_than(cutoff)
+            self.logger(f"Compacted seen-article history: evicted {evicted}, {len(self.checked_articles)} remaining")
+            purged = self.mail_spool.purge_finished(self.retention_hours * 3600)
+            purged_deliveries = self.delivery_ledger.purge_older_than(self.retention_hours * 3600, 'alert')
+            self.logger(f"Purged {purged} sent or failed emails from the mail spool and "
+                        f"{purged_deliveries} alert deliveries from the ledger")
+        except Exception as e:
+            self.logger(f"Error compacting seen-article history: {e}", level="ERROR")
+    
+    async def run_due_accounts_async(self):
+        """自适应调度：只抓取已到期的公众号"""
+        due_accounts = self.scheduler.due_accounts()
+        if not due_accounts:
+            return
+        self.logger(f"Accounts due for polling: {', '.join(due_accounts)}")
+        await self.run_once_async(due_accounts)
+        for account in due_accounts:
+            self.logger(f"Next poll for {account} at {self.scheduler.format_next_due(account)}")
+    
+    async def polling_loop(self):
+        """按固定间隔或自适应调度抓取公众号
         
-        # 设置定时任务
-        schedule.every(interval_hours).hours.do(self.run_once)
+        自适应模式下直接等到最近一个公众号到期，不再按固定的时间粒度检查。
+        """
+        interval_hours = self.config.get('interval_hours', 1)
+        if self.scheduler:
+            self.logger(f"Adaptive polling enabled, budget equivalent to every {interval_hours} hour(s) per account")
+        else:
+            self.logger(f"Scheduling monitoring every {interval_hours} hour(s)")
         
-        # 设置注册处理每3小时运行一次
-        schedule.every(3).hours.do(self.process_registrations)
+        # 重启后恢复了上次一轮抓取的时间时，等到原定时间再抓取，而不是立即全部重抓
+        if not self.scheduler and self.last_round_at is not None:
+            delay = self.last_round_at + interval_hours * 3600 - time.time()
+            if delay > 0:
+                next_run = datetime.now() + timedelta(seconds=delay)
+                self.logger(f"Resuming schedule, next run at: {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+                self.ready = True
+                await asyncio.sleep(delay)
         
         while True:
-            schedule.run_pending()
-            time.sleep(30)  # 每分钟检查一次是否有待执行的任务
-
-    def run(self):
-        """主运行循环"""
-        self.logger("Starting monitoring service...")
+            self.poll_wakeup.clear()
+            try:
+                if self.scheduler:
+                    await self.run_due_accounts_async()
+                    next_wakeup = self.scheduler.next_wakeup()
+                    timeout = None if next_wakeup is None else max(0.0, next_wakeup - time.time())
+                else:
+                    await self.run_once_async()
+                    timeout = self.config.get('interval_hours', 1) * 3600
+                    next_run = datetime.now() + timedelta(seconds=timeout)
+                    self.logger(f"Next run scheduled at: {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+            except Exception as e:
+                traceback.print_exc()
+                self.logger(f"Error in polling loop: {e}", level="ERROR")
+                self.logger(f"Waiting {self.ERROR_RETRY_SECONDS} seconds before retry...")
+                timeout = self.ERROR_RETRY_SECONDS
+            self.ready = True
+            try:
+                await asyncio.wait_for(self.poll_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def every(self, seconds, job, run_first=False):
+        """每隔 seconds 秒在线程中运行一次同步任务（文件和数据库I/O不阻塞事件循环），直到被取消"""
+        if not run_first:
+            await asyncio.sleep(seconds)
+        while True:
+            try:
+                await asyncio.to_thread(job)
+            except Exception as e:
+                traceback.print_exc()
+                self.logger(f"Error in {job.__name__}: {e}", level="ERROR")
+            await asyncio.sleep(seconds)
+    
+    def write_heartbeat(self, stopped=False):
+        """写入心跳文件（先写临时文件再替换，读取方不会读到写了一半的内容）"""
+        if self.heartbeat_path is None:
+            return
+        heartbeat = {
+            "pid": os.getpid(),
+            "ts": time.time(),
+            "started_at": self.started_at,
+            "ready": self.ready and not stopped,
+            "stopped": stopped,
+            "last_round_at": self.last_round_at,
+            "next_due": self.scheduler.snapshot_next_due() if self.scheduler else None,
+            "spool": self.mail_spool.counts()
+        }
+        tmp_path = self.heartbeat_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(heartbeat, f, ensure_ascii=False)
+            os.replace(tmp_path, self.heartbeat_path)
+        except Exception as e:
+            self.logger(f"Error writing heartbeat: {e}", level="ERROR")
+    
+    def resume(self, state_path):
+        """从上一个进程最后的心跳恢复调度状态，避免重启后立即重抓所有公众号
         
-        # 初始化计数器，用于跟踪运行的次数，每3次处理一次注册（即每3小时）
-        run_count = 0
+        游标、已检查文章和待发邮件本来就保存在 data/ 中，这里只恢复进程内的调度时间：
+        自适应模式下各公众号的下一次轮询时间，固定间隔模式下上一轮抓取的时间。
+        """
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            self.logger(f"Cannot resume from {state_path}, starting cold: {e}", level="WARNING")
+            return False
+        if self.scheduler and state.get('next_due'):
+            self.scheduler.restore_next_due(state['next_due'])
+            due = len(self.scheduler.due_accounts())
+            self.logger(f"Resumed polling schedule from {state_path}: {due}/{len(self.config['accounts'])} accounts due now")
+        elif not self.scheduler and state.get('last_round_at'):
+            self.last_round_at = float(state['last_round_at'])
+            self.logger(f"Resumed polling schedule from {state_path}: last run at "
+                        f"{datetime.fromtimestamp(self.last_round_at).strftime('%Y-%m-%d %H:%M:%S')}")
+        return True
+    
+    def save_state(self):
+        """保存抓取游标、推送历史和发件账号用量"""
+        self.save_account_cursors()
+        self.publish_history.save()
+        self.sender_pool.save()
+    
+    async def serve(self):
+        """运行监控服务直到收到停止信号
         
-        while True:
+        抓取、注册表轮询、配置热加载、汇总放行、历史压缩和邮件投递都是同一事件循环中的任务。
+        停止时先取消定时任务，等已开始抓取的公众号抓完（未开始的不再抓取），
+        再等投递任务发完手头的邮件，最后保存状态并关闭连接。
+        """
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.poll_wakeup = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                self.run_once()
-                
-                # 每3次运行（3小时）处理一次注册
-                run_count += 1
-                if run_count >= 3:
-                    self.logger("Processing registrations after 3 hours")
-                    self.process_registrations()
-                    run_count = 0
-                
-                next_run = datetime.now() + timedelta(hours=self.config['interval_hours'])
-                self.logger(f"Next run scheduled at: {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # 分钟级别的睡眠，便于更快响应中断
-                for _ in range(self.config['interval_hours'] * 30):
-                    time.sleep(30)
-                    
-            except KeyboardInterrupt:
-                self.logger("Received keyboard interrupt, shutting down...")
-                break
+                loop.add_signal_handler(sig, self.stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows 不支持，由 run() 捕获 KeyboardInterrupt
+                pass
+        
+        self.start_metrics_server()
+        delivery = asyncio.create_task(self.delivery_worker(), name="delivery")
+        tasks = [
+            asyncio.create_task(self.polling_loop(), name="polling"),
+            # 配置文件修改后热加载
+            asyncio.create_task(self.every(self.reload_poll_seconds, self.reload_changed_files), name="reload"),
+            # 轮询注册表，文件有追加时才读取新行
+            asyncio.create_task(
+                self.every(self.registration_poll_seconds, self.process_registrations, run_first=True),
+                name="registrations"
+            ),
+            # 定期淘汰过期的已检查文章
+            asyncio.create_task(
+                self.every(self.compaction_interval_hours * 3600, self.compact_history, run_first=True),
+                name="compaction"
+            ),
+        ]
+        # 汇总窗口到期后及时发送（汇总模式可以热加载开启或关闭，任务始终运行）
+        tasks.append(asyncio.create_task(self.every(60, self.flush_digest), name="digest"))
+        # 心跳由事件循环定期写入，事件循环卡住时心跳随之停止
+        if self.heartbeat_path is not None:
+            tasks.append(asyncio.create_task(
+                self.every(self.heartbeat_seconds, self.write_heartbeat, run_first=True), name="heartbeat"
+            ))
+        
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.stop_event.set()
+            self.logger("Shutting down monitoring service...")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 正在等待令牌（例如频率限制退避期间）的抓取线程立即放弃，不阻塞停止
+            self.rate_limiter.close()
+            await asyncio.to_thread(self.poll_executor.shutdown, wait=True, cancel_futures=True)
+            
+            if self.delivery_wakeup is not None:
+                self.delivery_wakeup.set()
+            try:
+                await asyncio.wait_for(delivery, self.SHUTDOWN_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                self.logger("Delivery did not finish in time, remaining emails stay in the spool", level="WARNING")
             except Exception as e:
-                self.logger(f"Error in main loop: {e}")
-                self.logger("Waiting 2 minutes before retry...")
-                time.sleep(120)  # 5分钟后重试
+                self.logger(f"Error stopping delivery worker: {e}", level="ERROR")
+            
+            await asyncio.to_thread(self.save_state)
+            await asyncio.to_thread(self.write_heartbeat, True)
+            await self.smtp_pool.close()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            self.logger("Monitoring service stopped")
+    
+    def run(self):
+        """主运行入口：在事件循环中运行 serve 直到收到停止信号"""
+        self.logger("Starting monitoring service...")
+        main_task = self.loop.create_task(self.serve())
+        try:
+            self.loop.run_until_complete(main_task)
+        except KeyboardInterrupt:
+            # 没有安装信号处理函数时（Windows），在这里转为正常停止
+            self.logger("Received keyboard interrupt, shutting down...")
+            if self.stop_event is not None:
+                self.stop_event.set()
+            self.loop.run_until_complete(main_task)
+        finally:
+            self.log_writer.flush()
+            self.events.flush()
 
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="WeChat official account keyword monitor")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--heartbeat", default=None, help="定期写入心跳的文件（由 daemon.py 指定）")
+    parser.add_argument("--resume", default=None, help="从上一个进程的心跳文件恢复调度状态")
+    parser.add_argument("--no-console", action="store_true",
+                        help="日志不输出到控制台（由 daemon.py 指定，日志已写入 logs/，避免守护进程重复记录）")
+    args = parser.parse_args()
+    
     print("WeChatMonitor starting...")
-    monitor = WeChatMonitor()
-    #monitor.process_registrations()
-    monitor.start_scheduler()
+    monitor = WeChatMonitor(args.config, console=False if args.no_console else None)
+    monitor.heartbeat_path = args.heartbeat
+    if args.resume:
+        monitor.resume(args.resume)
+    monitor.run()
 
 
 if __name__ == "__main__":